@@ -0,0 +1,15 @@
+from django.core.cache.backends.memcached import BaseMemcachedCache
+
+from google.appengine.api import memcache
+
+
+class MemcacheCache(BaseMemcachedCache):
+  """ Cache backend for App Engine's memcache service
+
+    App Engine's memcache.Client has the same interface as python-memcached,
+    so the django memcached backend can use it directly. LOCATION is ignored.
+  """
+
+  def __init__(self, server, params):
+    super(MemcacheCache, self).__init__(server, params, library=memcache,
+                                        value_not_found_exception=ValueError)
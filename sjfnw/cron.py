@@ -0,0 +1,32 @@
+import logging
+
+from django.http import HttpResponse
+
+from sjfnw import utils
+from sjfnw.fund import cron as fund_cron
+from sjfnw.grants import cron as grants_cron
+
+logger = logging.getLogger('sjfnw')
+
+# in the order they used to run as separate cron jobs
+DAILY_STAGES = [
+  ('yer_reminder_email', grants_cron.yer_reminder_stage),
+  ('new_accounts', fund_cron.new_accounts_stage),
+  ('email_overdue', fund_cron.overdue_stage),
+  ('gift_notify', fund_cron.gift_stage),
+  ('draft_app_warning', grants_cron.draft_warning_stage),
+]
+
+def daily_emails(request):
+  """ Run the daily email jobs as one request
+      NOTE: must run exactly once a day (see the individual jobs)
+
+    Stages share a snapshot of active memberships (see fund.cron.Snapshot) and
+    their emails are sent together, merged per recipient. Responds with each
+    stage's email count, query count and time; 500 if any stage failed.
+  """
+  stats = utils.run_stages(DAILY_STAGES, fund_cron.Snapshot(), merge=True)
+
+  summary = '\n'.join('{name}: {emails} emails, {queries} queries, {seconds:.2f}s{failed}'.format(
+      failed=' FAILED' if stat['error'] else '', **stat) for stat in stats)
+  return HttpResponse(summary, content_type='text/plain', status=utils.stages_status(stats))
@@ -2,17 +2,16 @@ import datetime, logging, json, re
 
 from django.contrib import admin
 from django.contrib.admin import SimpleListFilter
-from django.http import HttpResponse
+from django.db.models import Sum
 from django.utils import timezone
 from django.utils.safestring import mark_safe
 
-import unicodecsv
-
 from sjfnw import utils
 from sjfnw.admin import BaseModelAdmin, YearFilter
 from sjfnw.fund.models import (GivingProject, Member, Membership, Survey,
-    GPSurvey, Resource, ProjectResource, Donor, NewsItem, SurveyResponse)
+    GPSurvey, Resource, ProjectResource, Donor, DonorQuerySet, NewsItem, SurveyResponse)
 from sjfnw.fund import forms, modelforms, utils as fund_utils
+from sjfnw.fund.membership_cache import invalidate_memberships
 from sjfnw.grants.models import ProjectApp, GrantApplication
 
 logger = logging.getLogger('sjfnw')
@@ -233,6 +232,14 @@ class GivingProjectA(BaseModelAdmin):
     self.inlines = [MembershipInline, GPSurveyI, ProjectResourcesInline, ProjectAppInline]
     return super(GivingProjectA, self).change_view(request, object_id, form_url=form_url, extra_context=extra_context)
 
+  def get_queryset(self, request):
+    estimate = DonorQuerySet.estimated_expression(prefix='membership__donor__')
+    return (super(GivingProjectA, self).get_queryset(request)
+                                       .annotate(estimated_total=Sum(estimate)))
+
+  def estimated(self, obj):
+    return int(obj.estimated_total or 0)
+
   def gp_year(self, obj):
     year = obj.fundraising_deadline.year
     if year == timezone.now().year:
@@ -257,6 +264,17 @@ class MemberA(BaseModelAdmin):
   inlines = (MembershipInline,)
 
 
+def _annotated_progress(membership):
+  """ Progress dict like Membership.get_progress, from MembershipQuerySet.with_progress """
+  progress = {}
+  for key in ('estimated', 'promised', 'received_this', 'received_next', 'received_afternext'):
+    # MySQL returns decimals for sums, None if there are no donors
+    progress[key] = int(getattr(membership, 'progress_' + key) or 0)
+  progress['received_total'] = (progress['received_this'] + progress['received_next'] +
+                                progress['received_afternext'])
+  return progress
+
+
 class MembershipA(BaseModelAdmin):
   actions = ['approve']
   search_fields = ['member__first_name', 'member__last_name']
@@ -276,16 +294,19 @@ class MembershipA(BaseModelAdmin):
   ordering = ['-last_activity']
 
   def get_queryset(self, request):
-    return super(MembershipA, self).get_queryset(request).prefetch_related('donor_set')
+    return super(MembershipA, self).get_queryset(request).with_progress()
 
   def approve(self, _, queryset):
-    for memship in queryset:
+    memberships = list(queryset)
+    for memship in memberships:
       if memship.approved is False:
         fund_utils.notify_approval(memship)
-    queryset.update(approved=True)
+    # update by pk; queryset has annotations (see get_queryset) that can't be used in UPDATE
+    Membership.objects.filter(pk__in=[ship.pk for ship in memberships]).update(approved=True)
+    invalidate_memberships(memberships)
 
   def list_progress(self, obj): # for membership list - mimics columns
-    membership_progress = obj.get_progress()
+    membership_progress = _annotated_progress(obj)
     return ('<table class="nested-column nested-column-4"><tr><td>${estimated}</td>'
             '<td>${promised}</td><td>${received_total}</td>'
             '<td>{received_this}, {received_next}, {received_afternext}</td>'
@@ -296,7 +317,7 @@ class MembershipA(BaseModelAdmin):
   list_progress.allow_tags = True
 
   def progress(self, obj): # for single membership view
-    membership_progress = obj.get_progress()
+    membership_progress = _annotated_progress(obj)
     year = obj.giving_project.fundraising_deadline.year
     return (
         'Estimated: ${estimated}<br>Promised: ${promised}<br>'
@@ -305,6 +326,26 @@ class MembershipA(BaseModelAdmin):
       ).format(year=year, next=year + 1, after_next=year + 2, **membership_progress)
   progress.allow_tags = True
 
+  def overdue_steps(self, obj):
+    return obj.overdue_count
+
+
+def _donor_rows(donors):
+  """ Generate export_donors rows, so they are streamed rather than built up front """
+  count = 0
+  for donor in donors:
+    year = donor.membership.giving_project.fundraising_deadline.year
+    yield [donor.firstname, donor.lastname, donor.phone, donor.email,
+           donor.membership.member, donor.membership.giving_project,
+           donor.amount, donor.asked, donor.promised, donor.received(),
+           year, donor.received_this, year + 1, donor.received_next, year + 2,
+           donor.received_afternext, donor.notes,
+           donor.get_likely_to_join_display(),
+           donor.promise_reason_display(), donor.total_promised(),
+           donor.match_expected, donor.match_received, donor.match_company]
+    count += 1
+  logger.info('%d donors exported', count)
+
 
 class DonorA(BaseModelAdmin):
   actions = ['export_donors']
@@ -344,31 +385,16 @@ class DonorA(BaseModelAdmin):
   def export_donors(self, request, queryset):
     logger.info('Export donors called by %s', request.user.username)
 
-    response = HttpResponse(content_type='text/csv')
-    response['Content-Disposition'] = 'attachment; filename=prospects.csv'
-    writer = unicodecsv.writer(response)
-
-    writer.writerow(['First name', 'Last name', 'Phone', 'Email', 'Member',
-                     'Giving Project', 'Amount to ask', 'Asked', 'Promised',
-                     'Received - TOTAL', 'Received - Year', 'Received - Amount',
-                     'Received - Year', 'Received - Amount',
-                     'Received - Year', 'Received - Amount', 'Notes',
-                     'Likelihood of joining a GP', 'Reasons for donating'])
-    count = 0
-    for donor in queryset:
-      year = donor.membership.giving_project.fundraising_deadline.year
-      fields = [donor.firstname, donor.lastname, donor.phone, donor.email,
-                donor.membership.member, donor.membership.giving_project,
-                donor.amount, donor.asked, donor.promised, donor.received(),
-                year, donor.received_this, year + 1, donor.received_next, year + 2,
-                donor.received_afternext, donor.notes,
-                donor.get_likely_to_join_display(),
-                donor.promise_reason_display(), donor.total_promised(),
-                donor.match_expected, donor.match_received, donor.match_company]
-      writer.writerow(fields)
-      count += 1
-    logger.info(str(count) + ' donors exported')
-    return response
+    header = ['First name', 'Last name', 'Phone', 'Email', 'Member',
+              'Giving Project', 'Amount to ask', 'Asked', 'Promised',
+              'Received - TOTAL', 'Received - Year', 'Received - Amount',
+              'Received - Year', 'Received - Amount',
+              'Received - Year', 'Received - Amount', 'Notes',
+              'Likelihood of joining a GP', 'Reasons for donating',
+              'Total promised', 'Match expected', 'Match received', 'Match company']
+    donors = (queryset.select_related('membership__member', 'membership__giving_project')
+                      .iterator())
+    return utils.csv_response('prospects', header, _donor_rows(donors))
 
 
 class NewsA(BaseModelAdmin):
@@ -419,37 +445,24 @@ class SurveyResponseA(BaseModelAdmin):
   display_responses.short_description = 'Responses'
 
   def export_responses(self, request, queryset):
-
     logger.info('Export survey responses called by ' + request.user.username)
-    response = HttpResponse(content_type='text/csv')
-    response['Content-Disposition'] = ('attachment; filename=survey_responses %s.csv'
-        % timezone.now().strftime('%Y-%m-%d'))
-    writer = unicodecsv.writer(response)
 
-    header = ['Date', 'Survey ID', 'Giving Project', 'Survey'] # base
+    # first pass reads only the responses column, to size the header
     questions = 0
-    response_rows = []
-    for survey in queryset:
-      fields = [survey.date, survey.gp_survey_id,
-                survey.gp_survey.giving_project.title,
-                survey.gp_survey.survey.title]
-      logger.info(isinstance(survey.responses, str))
-      responses = json.loads(survey.responses)
-      for i in range(0, len(responses), 2):
-        fields.append(responses[i])
-        fields.append(responses[i + 1])
-        questions = max(questions, (i + 2) / 2)
-      response_rows.append(fields)
-
+    for responses in queryset.values_list('responses', flat=True).iterator():
+      questions = max(questions, len(json.loads(responses)) / 2)
     logger.info('Max %d questions', questions)
-    for i in range(0, questions):
-      header.append('Question')
-      header.append('Answer')
-    writer.writerow(header)
-    for row in response_rows:
-      writer.writerow(row)
-
-    return response
+
+    header = ['Date', 'Survey ID', 'Giving Project', 'Survey'] # base
+    header += ['Question', 'Answer'] * questions
+
+    surveys = (queryset.select_related('gp_survey__giving_project', 'gp_survey__survey')
+                       .iterator())
+    rows = ([survey.date, survey.gp_survey_id, survey.gp_survey.giving_project.title,
+             survey.gp_survey.survey.title] + json.loads(survey.responses)
+            for survey in surveys)
+    return utils.csv_response(
+        'survey_responses {}'.format(timezone.now().strftime('%Y-%m-%d')), header, rows)
 
 # -----------------------------------------------------------------------------
 #  Register
@@ -0,0 +1,59 @@
+""" Cached news & grants lists for the top blocks of member pages
+
+  Every member of a giving project sees the same news and grants, so they are
+  cached per project. Keys include a version number which is bumped to
+  invalidate: when a NewsItem is saved, a ProjectApp is saved or deleted, or
+  the giving project is saved (e.g. site_visits toggled). See receivers in
+  fund and grants models.py. Uses the default cache; see CACHES in settings.
+"""
+import logging, time
+
+from django.core.cache import cache
+
+logger = logging.getLogger('sjfnw')
+
+# old versions are never read again, so this is just to let them expire
+CACHE_TIMEOUT = 60 * 60 * 24
+
+def _version_key(project_id):
+  return 'fund-blocks-version-{}'.format(project_id)
+
+def _blocks_key(project_id, version):
+  return 'fund-blocks-{}-{}'.format(project_id, version)
+
+def _new_version():
+  # if the version key is evicted, starting over from a timestamp (rather
+  # than 0) keeps it from colliding with a version that is still cached
+  return int(time.time() * 1000)
+
+def _get_version(project_id):
+  key = _version_key(project_id)
+  version = cache.get(key)
+  if version is None:
+    version = _new_version()
+    if not cache.add(key, version, None): # another request set it first
+      version = cache.get(key, version)
+  return version
+
+def get_project_blocks(project_id, compute):
+  """ Get a giving project's block content from the cache
+
+    Args:
+      project_id: pk of GivingProject
+      compute: function that returns the content, called on cache miss.
+        Content must be picklable (evaluate querysets first)
+  """
+  key = _blocks_key(project_id, _get_version(project_id))
+  blocks = cache.get(key)
+  if blocks is None:
+    blocks = compute()
+    cache.set(key, blocks, CACHE_TIMEOUT)
+  return blocks
+
+def invalidate_project_blocks(project_id):
+  """ Bump the project's version so cached block content is no longer used """
+  key = _version_key(project_id)
+  try:
+    cache.incr(key)
+  except ValueError: # not in cache
+    cache.set(key, _new_version(), None)
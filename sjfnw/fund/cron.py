@@ -1,4 +1,5 @@
 import datetime
+from itertools import groupby
 import logging
 
 from django.http import HttpResponse
@@ -6,36 +7,84 @@ from django.utils import timezone
 
 from sjfnw import constants as c, utils
 from sjfnw.fund import models
+from sjfnw.fund.membership_cache import invalidate_memberships
 
 logger = logging.getLogger('sjfnw')
 
+
+class Snapshot(object):
+  """ Data shared by cron stages (see utils.run_stages), loaded on first use
+
+    memberships: all memberships in active giving projects, with giving
+      project and member's user loaded, ordered by giving project
+  """
+
+  def __init__(self):
+    self.today = timezone.now().date()
+    self._memberships = None
+
+  @property
+  def memberships(self):
+    if self._memberships is None:
+      self._memberships = list(models.Membership.objects
+          .filter(giving_project__fundraising_deadline__gte=self.today)
+          .select_related('giving_project', 'member__user')
+          .order_by('giving_project_id', 'pk'))
+    return self._memberships
+
+
 def email_overdue(request):
+  """ Email members about overdue steps, at most once a week per membership """
+  stats = utils.run_stages([('email_overdue', overdue_stage)], Snapshot())
+  return HttpResponse('', status=utils.stages_status(stats))
+
+def overdue_stage(snapshot):
+  """ Build overdue step emails for eligible memberships in snapshot
+
+    Overdue steps for all of them are fetched in one query, which gives the
+    count and most recent step for each. Memberships are marked emailed with a
+    single update once the emails are sent.
+  """
   today = datetime.date.today()
-  ships = models.Membership.objects.filter(giving_project__fundraising_deadline__gte=today)
   limit = today - datetime.timedelta(days=7)
+  # same as Membership.overdue_steps
+  cutoff = timezone.now().date() - datetime.timedelta(days=1)
   subject = 'Fundraising Steps'
   from_email = c.FUND_EMAIL
 
+  eligible = [ship for ship in snapshot.memberships
+              if ship.emailed is None or ship.emailed <= limit]
+  if not eligible:
+    return [], None
+
+  # overdue count and most recent overdue step for each membership
+  counts, next_steps = {}, {}
+  steps = (models.Step.objects
+      .filter(donor__membership__in=[ship.pk for ship in eligible],
+              completed__isnull=True, date__lt=cutoff)
+      .select_related('donor')
+      .order_by('-date'))
+  for step in steps:
+    ship_id = step.donor.membership_id
+    counts[ship_id] = counts.get(ship_id, 0) + 1
+    next_steps.setdefault(ship_id, step)
+
+  batch = utils.EmailBatch(subject, from_email, 'fund/emails/overdue_steps.html',
+      shared_context={'login_url': c.APP_BASE_URL + '/fund/login',
+                      'base_url': c.APP_BASE_URL})
+  ships = [ship for ship in eligible if ship.pk in next_steps]
   for ship in ships:
-    member = ship.member
-    if not ship.emailed or (ship.emailed <= limit):
-      count, step = ship.overdue_steps(get_next=True)
-      if count > 0 and step:
-        to_email = ship.member.user.username
-        logger.info('%s has overdue step(s), emailing.', to_email)
-        utils.send_email(
-          subject=subject,
-          to=[to_email],
-          sender=from_email,
-          template='fund/emails/overdue_steps.html',
-          context={
-            'login_url': c.APP_BASE_URL + '/fund/login', 'ship': ship, 'num': count,
-            'step': step, 'base_url': c.APP_BASE_URL
-          }
-        )
-        ship.emailed = today
-        ship.save(skip=True)
-  return HttpResponse('')
+    to_email = ship.member.user.username
+    logger.info('%s has overdue step(s), emailing.', to_email)
+    batch.add([to_email], context={
+      'ship': ship, 'num': counts[ship.pk], 'step': next_steps[ship.pk]
+    })
+
+  def mark_emailed():
+    models.Membership.objects.filter(pk__in=[ship.pk for ship in ships]).update(emailed=today)
+    invalidate_memberships(ships)
+
+  return batch.messages, mark_emailed if ships else None
 
 
 def new_accounts(request):
@@ -43,70 +92,79 @@ def new_accounts(request):
 
     Will continue emailing about the same membership until it's approved/deleted.
   """
+  stats = utils.run_stages([('new_accounts', new_accounts_stage)], Snapshot())
+  return HttpResponse('', status=utils.stages_status(stats))
 
+def new_accounts_stage(snapshot):
+  """ Build pending approval emails from snapshot's memberships, grouped by project """
   subject = 'Accounts pending approval'
   from_email = c.FUND_EMAIL
 
-  active_gps = models.GivingProject.objects.filter(fundraising_deadline__gte=timezone.now().date())
+  batch = utils.EmailBatch(subject, from_email, 'fund/emails/accounts_need_approval.html',
+      shared_context={'admin_url': c.APP_BASE_URL + '/admin/fund/membership/',
+                      'support_email': c.SUPPORT_EMAIL})
 
-  for gp in active_gps:
-    memberships = models.Membership.objects.filter(giving_project=gp)
-    need_approval = memberships.filter(approved=False).count()
+  for _, ships in groupby(snapshot.memberships, key=lambda ship: ship.giving_project_id):
+    ships = list(ships)
+    need_approval = len([ship for ship in ships if not ship.approved])
     if need_approval > 0:
-      leaders = memberships.filter(leader=True)
-      to_emails = [leader.member.user.username for leader in leaders]
+      gp = ships[0].giving_project
+      to_emails = [ship.member.user.username for ship in ships if ship.leader]
       if to_emails:
-        utils.send_email(
-          subject=subject,
-          to=to_emails,
-          sender=from_email,
-          template='fund/emails/accounts_need_approval.html',
-          context={
-            'admin_url': c.APP_BASE_URL + '/admin/fund/membership/',
-            'count': need_approval,
-            'giving_project': unicode(gp),
-            'support_email': c.SUPPORT_EMAIL
-          }
-        )
-        logger.info('%d unapproved memberships in %s. Email sent to %s',
+        batch.add(to_emails, context={'count': need_approval, 'giving_project': unicode(gp)})
+        logger.info('%d unapproved memberships in %s. Emailing %s',
             need_approval, unicode(gp), ', '.join(to_emails))
 
-  return HttpResponse('')
+  return batch.messages, None
+
 
 def gift_notify(request):
   """ Set gift received notifications on membership object and send an email
       Marks donors as notified """
+  stats = utils.run_stages([('gift_notify', gift_stage)], Snapshot())
+  return HttpResponse('', status=utils.stages_status(stats))
+
+def gift_stage(_):
+  """ Build gift received emails, one per membership with new gifts
 
+    Runs in a fixed number of queries: donors are fetched with their members,
+    and once emails are sent, notifications are set with one UPDATE per batch
+    of memberships. Only the donors processed here are marked notified, so
+    gifts entered while this runs are picked up next time.
+  """
   donors = (models.Donor.objects
-      .select_related('membership__member')
+      .select_related('membership__member__user')
       .filter(gift_notified=False)
-      .exclude(received_this=0, received_next=0, received_afternext=0))
-
-  memberships = {}
-  for donor in donors:
-    if donor.membership not in memberships:
-      memberships[donor.membership] = []
-    memberships[donor.membership].append(donor)
+      .exclude(received_this=0, received_next=0, received_afternext=0)
+      .order_by('membership_id', 'pk'))
 
   login_url = c.APP_BASE_URL + '/fund/'
   subject = 'Gift or pledge received'
   from_email = c.FUND_EMAIL
 
-  for ship, donor_list in memberships.iteritems():
+  batch = utils.EmailBatch(subject, from_email, 'fund/emails/gift_received.html',
+                           shared_context={'login_url': login_url})
+
+  notifications = {}
+  memberships = []
+  donor_ids = []
+  for ship, donor_list in groupby(donors, key=lambda donor: donor.membership):
     gift_str = ''
     for donor in donor_list:
       gift_str += u'${}  gift or pledge received from {}! '.format(donor.received(), donor)
-    ship.notifications = gift_str
-    ship.save(skip=True)
-
-    utils.send_email(
-      subject=subject,
-      to=[ship.member.user.username],
-      sender=from_email,
-      template='fund/emails/gift_received.html',
-      context={'login_url': login_url, 'gift_str': ship.notifications}
-    )
-    logger.info('Set gift notification and sent email to %s', ship.member.user.username)
-
-  donors.update(gift_notified=True)
-  return HttpResponse('')
+      donor_ids.append(donor.pk)
+    notifications[ship.pk] = gift_str
+    memberships.append(ship)
+
+    batch.add([ship.member.user.username], context={'gift_str': gift_str})
+    logger.info('Set gift notification and emailing %s', ship.member.user.username)
+
+  if not memberships:
+    return [], None
+
+  def set_notified():
+    models.Membership.objects.set_notifications(notifications)
+    invalidate_memberships(memberships)
+    models.Donor.objects.filter(pk__in=donor_ids).update(gift_notified=True)
+
+  return batch.messages, set_notified
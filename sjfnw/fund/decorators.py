@@ -7,6 +7,8 @@ from django.http import HttpResponse
 from django.shortcuts import redirect
 from django.utils.decorators import available_attrs
 
+from sjfnw.fund.membership_cache import get_current_membership
+
 logger = logging.getLogger('sjfnw')
 
 
@@ -14,6 +16,7 @@ def require_member(require_membership=False):
   """ Require request.user that is authenticed, active and has associated member
 
       If require_membership is True, require that the member is on an approved membership
+      and set it as request.membership (cached; see membership_cache)
   """
   def decorator(view_func):
 
@@ -33,11 +36,7 @@ def require_member(require_membership=False):
         return redirect(reverse('sjfnw.fund.views.not_member'))
 
       if require_membership:
-        membership = None
-        if request.user.member.current:
-          membership = (request.user.member.membership_set
-                                           .filter(pk=request.user.member.current)
-                                           .first())
+        membership = get_current_membership(request.user.member)
         if not membership:
           return redirect(reverse('sjfnw.fund.views.manage_account'))
 
@@ -70,9 +70,16 @@ class MassDonor(MassDonorPre):
                                   widget=forms.TextInput())
 
 
+class ImportContacts(forms.Form):
+  """ Upload a spreadsheet of contacts; rows are validated with MassDonor(Pre) """
+  contacts_file = forms.FileField(label='CSV or tab-separated file',
+      help_text=('First row should be column names: first name, last name and, once '
+                 'estimates are required, amount and likelihood.'))
+
+
 class DonorEstimates(forms.Form):
-  donor = forms.ModelChoiceField(queryset=models.Donor.objects.all(),
-                                 widget=forms.HiddenInput())
+  # pk only; view checks that it belongs to the membership
+  donor = forms.IntegerField(widget=forms.HiddenInput())
   amount = IntegerCommaField(label='*Estimated donation ($)',
                              min_value=0,
                              widget=forms.TextInput())
@@ -89,8 +96,8 @@ class MassStep(forms.Form):
   description = forms.CharField(
       max_length=255, required=False,
       widget=forms.TextInput(attrs={'onfocus': 'showSuggestions(this.id)', 'size': '34'}))
-  donor = forms.ModelChoiceField(queryset=models.Donor.objects.all(),
-                                 widget=forms.HiddenInput())
+  # pk only; view checks that it belongs to the membership
+  donor = forms.IntegerField(widget=forms.HiddenInput())
 
   def clean(self): # date/desc pair validation
     cleaned_data = super(MassStep, self).clean()
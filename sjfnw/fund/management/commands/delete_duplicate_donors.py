@@ -20,7 +20,7 @@ class Command(BaseCommand):
           donor.firstname == prior.firstname and
           donor.lastname and donor.lastname == prior.lastname and
           not donor.talked):
-        if donor.get_next_step():
+        if donor.next_step_id:
           self.stdout.write(unicode(donor) + ' matched but has a step. Not deleting.')
         else:
           self.stdout.write('Deleting ' + unicode(donor))
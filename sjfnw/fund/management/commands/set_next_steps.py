@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from sjfnw.fund.models import Donor
+
+
+class Command(BaseCommand):
+
+  help = ('Sets next_step and next_step_date on all donors from their incomplete steps. '
+          'Migration 0009 sets them initially and they are kept up to date after that; '
+          'this is for repairing them if steps were written without signals.')
+
+  def handle(self, *args, **options):
+    self.stdout.write('Beginning.\n')
+    updated = Donor.objects.all().update_next_steps()
+    self.stdout.write('{} donors updated.\n'.format(updated))
@@ -0,0 +1,49 @@
+""" Short-lived cache of each member's current Membership, used by require_member
+
+  The membership is cached along with its giving project. Keys include the
+  membership id, so changing Member.current (set_current, _create_membership)
+  moves to a new key. Cached memberships are cleared when a Membership is saved
+  or deleted, or its giving project is saved (see receivers in models.py).
+  Bulk updates need to call invalidate_memberships themselves.
+"""
+import logging
+
+from django.core.cache import cache
+
+logger = logging.getLogger('sjfnw')
+
+# short, in case of writes that skip invalidation
+CACHE_TIMEOUT = 60 * 5
+
+def _membership_key(member_id, membership_id):
+  return 'fund-membership-{}-{}'.format(member_id, membership_id)
+
+def get_current_membership(member):
+  """ Get member's current Membership, with giving_project loaded
+
+    Returns:
+      Membership, or None if member.current is not set or not found
+  """
+  if not member.current:
+    return None
+  key = _membership_key(member.pk, member.current)
+  membership = cache.get(key)
+  if membership is None:
+    membership = (member.membership_set.select_related('giving_project')
+                                       .filter(pk=member.current)
+                                       .first())
+    if membership:
+      cache.set(key, membership, CACHE_TIMEOUT)
+  return membership
+
+def invalidate_memberships(memberships):
+  """ Clear cached copies of the given memberships """
+  invalidate_membership_ids([(ship.member_id, ship.pk) for ship in memberships])
+
+def invalidate_membership_ids(id_pairs):
+  """ Clear cached memberships without loading them
+
+    Args:
+      id_pairs: iterable of (member_id, membership_id), e.g. from values_list
+  """
+  cache.delete_many([_membership_key(member_id, ship_id) for member_id, ship_id in id_pairs])
@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fund', '0007_member_alter_user_field'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='donor',
+            name='next_step',
+            field=models.ForeignKey(related_name='+', on_delete=django.db.models.deletion.SET_NULL, blank=True, editable=False, to='fund.Step', null=True),
+        ),
+        migrations.AddField(
+            model_name='donor',
+            name='next_step_date',
+            field=models.DateField(db_index=True, null=True, editable=False, blank=True),
+        ),
+    ]
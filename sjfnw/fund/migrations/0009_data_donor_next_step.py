@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+BATCH_SIZE = 100
+
+
+def set_next_steps(apps, schema_editor):
+    """ Set next_step and next_step_date on donors from their earliest incomplete step
+
+      Same as DonorQuerySet.update_next_steps, which historical models don't have.
+      The fields were just added, so only donors with incomplete steps need updating.
+    """
+    Donor = apps.get_model("fund", "Donor")
+    Step = apps.get_model("fund", "Step")
+
+    next_steps = {}
+    steps = (Step.objects.filter(completed__isnull=True)
+             .order_by('date', 'pk').values_list('donor_id', 'pk', 'date'))
+    for donor_id, step_id, date in steps:
+      next_steps.setdefault(donor_id, (step_id, date))
+
+    donor_ids = sorted(next_steps)
+    for start in range(0, len(donor_ids), BATCH_SIZE):
+      batch = donor_ids[start:start + BATCH_SIZE]
+
+      def value_for(index, output_field):
+        return models.Case(
+          *[models.When(pk=donor_id, then=models.Value(next_steps[donor_id][index]))
+            for donor_id in batch],
+          output_field=output_field)
+
+      Donor.objects.filter(pk__in=batch).update(
+          next_step=value_for(0, models.IntegerField()),
+          next_step_date=value_for(1, models.DateField()))
+
+def unset_next_steps(apps, schema_editor):
+    Donor = apps.get_model("fund", "Donor")
+    Donor.objects.all().update(next_step=None, next_step_date=None)
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fund', '0008_donor_next_step'),
+    ]
+
+    operations = [
+        migrations.RunPython(set_next_steps, reverse_code=unset_next_steps)
+    ]
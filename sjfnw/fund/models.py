@@ -1,11 +1,18 @@
-import datetime, json, logging
+import datetime, json, logging, threading
 
 from django.contrib.auth.models import User
 from django.contrib.humanize.templatetags.humanize import intcomma
 from django.core.validators import MaxValueValidator, MinValueValidator
 from django.db import models
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Coalesce
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
 from django.utils import timezone
 
+from sjfnw.fund.blocks import invalidate_project_blocks
+from sjfnw.fund.membership_cache import invalidate_membership_ids, invalidate_memberships
+from sjfnw.fund.progress import invalidate_progress, invalidate_project_progress
 from sjfnw.fund.utils import notify_approval
 
 logger = logging.getLogger('sjfnw')
@@ -85,11 +92,38 @@ class GivingProject(models.Model):
     return self.fundraising_training <= timezone.now()
 
   def estimated(self):
-    donors = Donor.objects.filter(membership__giving_project=self)
-    estimated = 0
-    for donor in donors:
-      estimated += donor.estimated()
-    return estimated
+    """ Sum of the project's donor estimates, in a single query """
+    total = (Donor.objects.filter(membership__giving_project=self)
+                          .aggregate(total=models.Sum(DonorQuerySet.estimated_expression())))
+    return int(total['total'] or 0)
+
+  def get_progress(self):
+    """ Compiles project-wide progress metrics in a single query
+
+      Contacts are counted as asked, or talked if not asked. Money is counted as
+      received if the contact has any gifts received, otherwise as promised.
+
+      Returns:
+        dict with contacts, talked, asked, promised, received,
+        contacts_remaining and togo (amount left to reach fund_goal)
+    """
+    progress = Donor.objects.filter(membership__giving_project=self).aggregate(
+      contacts=models.Count('pk'),
+      talked=_count_if(asked=False, talked=True),
+      asked=_count_if(asked=True),
+      received=models.Sum(DonorQuerySet.received_expression()),
+      promised=models.Sum(models.Case(
+        models.When(~DonorQuerySet.has_received() & models.Q(promised__gt=0),
+                    then=models.F('match_expected') + models.F('promised')),
+        default=0, output_field=models.IntegerField()))
+    )
+    # sums are None when there are no donors
+    for key in progress:
+      progress[key] = progress[key] or 0
+
+    progress['contacts_remaining'] = progress['contacts'] - progress['talked'] - progress['asked']
+    progress['togo'] = max(self.fund_goal - progress['promised'] - progress['received'], 0)
+    return progress
 
 
 class MemberManager(models.Manager):
@@ -123,8 +157,63 @@ class Member(models.Model):
     ordering = ['first_name', 'last_name']
 
 
+class MembershipQuerySet(models.QuerySet):
+
+  def with_progress(self):
+    """ Annotate each membership's progress in SQL, to avoid per-row queries in lists
+
+      Adds progress_estimated, progress_promised, progress_received_this,
+      progress_received_next and progress_received_afternext (see get_progress;
+      sums are None when there are no donors) and overdue_count (see overdue_steps).
+    """
+    # overdue steps are counted in a subquery; joining steps would multiply donor sums
+    cutoff = timezone.now().date() - datetime.timedelta(days=1)
+    overdue_sql = (
+      'SELECT COUNT(*) FROM {step} INNER JOIN {donor} ON {step}.donor_id = {donor}.id '
+      'WHERE {donor}.membership_id = {membership}.id AND {step}.completed IS NULL '
+      'AND {step}.date < %s'
+    ).format(step=Step._meta.db_table, donor=Donor._meta.db_table,
+             membership=Membership._meta.db_table)
+
+    return self.annotate(
+      progress_estimated=models.Sum(DonorQuerySet.estimated_expression(prefix='donor__')),
+      progress_promised=models.Sum(models.Case(
+        models.When(donor__promised__gt=0,
+                    then=models.F('donor__match_expected') + models.F('donor__promised')),
+        default=0, output_field=models.IntegerField())),
+      progress_received_this=models.Sum('donor__received_this'),
+      progress_received_next=models.Sum('donor__received_next'),
+      progress_received_afternext=models.Sum('donor__received_afternext'),
+      overdue_count=RawSQL(overdue_sql, (cutoff,))
+    )
+
+  def set_notifications(self, notifications, batch_size=100):
+    """ Set notifications on memberships, one UPDATE per batch
+
+      Like update(), doesn't send signals; use invalidate_memberships after
+
+      Args:
+        notifications: dict of membership pk -> notifications text
+        batch_size: max memberships per UPDATE
+
+      Returns:
+        number of memberships updated
+    """
+    updated = 0
+    ship_ids = sorted(notifications)
+    for start in range(0, len(ship_ids), batch_size):
+      batch = ship_ids[start:start + batch_size]
+      text = models.Case(
+        *[models.When(pk=ship_id, then=models.Value(notifications[ship_id]))
+          for ship_id in batch],
+        output_field=models.TextField())
+      updated += self.filter(pk__in=batch).update(notifications=text)
+    return updated
+
+
 class Membership(models.Model):
   """ Represents a relationship between a member and a giving project """
+  objects = MembershipQuerySet.as_manager()
 
   giving_project = models.ForeignKey(GivingProject)
   member = models.ForeignKey(Member)
@@ -150,18 +239,37 @@ class Membership(models.Model):
   def __unicode__(self):
     return u'{}, {}'.format(self.member, self.giving_project)
 
+  def __init__(self, *args, **kwargs):
+    super(Membership, self).__init__(*args, **kwargs)
+    self._loaded_values = self._field_values()
+
+  def _field_values(self):
+    """ Values of loaded fields. Deferred fields are left out rather than fetched """
+    return {field.attname: self.__dict__[field.attname]
+            for field in self._meta.concrete_fields
+            if not field.primary_key and field.attname in self.__dict__}
+
+  def changed_fields(self):
+    """ Names of fields that have changed since the membership was loaded or saved """
+    loaded = self._loaded_values
+    return [name for name, value in self._field_values().iteritems()
+            if name not in loaded or loaded[name] != value]
+
   def save(self, skip=False, *args, **kwargs):
-    """ Checks whether to send an approval email unless skip is True """
-    if not skip:
-      try:
-        previous = Membership.objects.get(pk=self.pk)
-        logger.debug('Previously: %s, now %s ', previous.approved, self.approved)
-        if self.approved and not previous.approved:
-          logger.debug('Detected approval on save for ' + unicode(self))
-          notify_approval(self)
-      except Membership.DoesNotExist: # this is the first save for this membership
-        pass
+    """ Checks whether to send an approval email unless skip is True
+
+      Existing memberships only write fields that have changed (see
+      changed_fields) unless update_fields or force_insert is given
+    """
+    if not self._state.adding:
+      if not skip and self.approved and not self._loaded_values.get('approved', True):
+        logger.debug('Detected approval on save for ' + unicode(self))
+        notify_approval(self)
+      if not kwargs.get('force_insert') and kwargs.get('update_fields') is None:
+        # an empty list makes this a no-op
+        kwargs['update_fields'] = self.changed_fields()
     super(Membership, self).save(*args, **kwargs)
+    self._loaded_values = self._field_values()
 
   def get_progress(self):
     """ Compiles progress metrics (estimated, promised, received by year) """
@@ -201,41 +309,42 @@ class Membership(models.Model):
       return count, steps[0]
 
   def update_story(self, timestamp):
+    """ Create or update the news story for steps completed on timestamp's day
+
+      Each donor counts once: as asked if any of the day's steps was an ask,
+      otherwise as talked to.
+    """
     logger.info('update_story running for membership %d from %s', self.pk, timestamp)
 
     day_min = timestamp.replace(hour=0, minute=0, second=0)
     day_max = timestamp.replace(hour=23, minute=59, second=59)
 
-    steps = Step.objects.filter(
-        donor__membership_id=self.pk, completed__range=(day_min, day_max)
-      ).select_related('donor')
+    steps = (Step.objects
+        .filter(donor__membership_id=self.pk, completed__range=(day_min, day_max))
+        .values_list('donor_id', 'asked', 'promised'))
+
+    # tally news-worthy milestones from steps
+    talked_ids, asked_ids, promised = set(), set(), 0
+    for donor_id, step_asked, step_promised in steps:
+      if step_asked:
+        asked_ids.add(donor_id)
+      else:
+        talked_ids.add(donor_id)
+      if step_promised:
+        promised += step_promised
 
-    if not steps:
+    if not talked_ids and not asked_ids:
       logger.warning('update_story called on %d but no steps were completed', self.pk)
       return
 
+    # don't count talked + asked for same donor
+    talked, asked = len(talked_ids - asked_ids), len(asked_ids)
+
     # get or create NewsItem instance
     logger.debug('Checking for story with date between %s and %s', day_min, day_max)
     search = self.newsitem_set.filter(date__range=(day_min, day_max))
     story = search[0] if search else NewsItem(date=timestamp, membership=self)
 
-    # tally news-worthy milestones from steps
-    talked, asked, promised = 0, 0, 0
-    talkedlist = [] # used to make sure each individual donor only counts once
-    askedlist = []
-    for step in steps:
-      if step.asked:
-        asked += 1
-        askedlist.append(step.donor_id)
-        if step.donor_id in talkedlist: # don't count talked + asked for same donor
-          talked -= 1
-          talkedlist.remove(step.donor)
-      elif step.donor not in talkedlist and step.donor not in askedlist:
-        talked += 1
-        talkedlist.append(step.donor)
-      if step.promised and step.promised > 0:
-        promised += step.promised
-
     # create summary blurb
     summary = self.member.first_name
     if talked > 0:
@@ -245,10 +354,8 @@ class Membership(models.Model):
           summary += u', asked {}'.format(asked)
         else:
           summary += u' and asked {}'.format(asked)
-    elif asked > 0:
-      summary += u' asked {} {}'.format(asked, 'people' if asked > 1 else 'person')
     else:
-      logger.error('News update with 0 talked, 0 asked. Story pk: %d', story.pk)
+      summary += u' asked {} {}'.format(asked, 'people' if asked > 1 else 'person')
     if promised > 0:
       summary += u' and got ${} in promises'.format(intcomma(promised))
     summary += u'.'
@@ -259,6 +366,173 @@ class Membership(models.Model):
     logger.info('Story saved')
 
 
+def _count_if(*args, **kwargs):
+  """ Aggregate that counts rows matching the given conditions (see When) """
+  return models.Sum(models.Case(models.When(*args, then=1, **kwargs), default=0,
+                                output_field=models.IntegerField()))
+
+
+class _Greatest(models.Func):
+  """ Larger of the given expressions. Django 1.9 adds this as Greatest """
+  function = 'GREATEST'
+
+  def as_sqlite(self, compiler, connection):
+    return self.as_sql(compiler, connection, function='MAX')
+
+
+class DonorQuerySet(models.QuerySet):
+
+  @staticmethod
+  def has_received():
+    """ Q for donors with any gifts received; see Donor.received """
+    return (models.Q(received_this__gt=0) | models.Q(received_next__gt=0) |
+            models.Q(received_afternext__gt=0) | models.Q(match_received__gt=0))
+
+  @staticmethod
+  def received_expression():
+    """ SQL equivalent of Donor.received """
+    return (models.F('received_this') + models.F('received_next') +
+            models.F('received_afternext') + models.F('match_received'))
+
+  @staticmethod
+  def total_promised_expression():
+    """ SQL equivalent of Donor.total_promised """
+    return models.F('match_expected') + Coalesce('promised', models.Value(0))
+
+  @staticmethod
+  def estimated_expression(prefix=''):
+    """ SQL equivalent of Donor.estimated. Subtracts the remainder so division
+      is exact (and integer) regardless of backend
+
+      Args:
+        prefix: path to donor fields when used from a related model,
+          e.g. 'membership__donor__'
+    """
+    amount, likelihood = prefix + 'amount', prefix + 'likelihood'
+    product = models.F(amount) * models.F(likelihood)
+    return models.Case(
+      models.When(then=(product - product % 100) / 100,
+                  **{amount + '__gt': 0, likelihood + '__gt': 0}),
+      default=0, output_field=models.IntegerField())
+
+  def name_keys(self):
+    """ Set of Donor.name_key for these donors, for duplicate checks """
+    return {Donor.name_key(firstname, lastname)
+            for firstname, lastname in self.values_list('firstname', 'lastname')}
+
+  def with_totals(self):
+    """ Annotate donors with received_total, promised_total and estimate """
+    return self.annotate(
+      received_total=self.received_expression(),
+      promised_total=self.total_promised_expression(),
+      estimate=self.estimated_expression())
+
+  def order_by_next_step(self):
+    """ with_totals, ordered by next step date. Donors without an incomplete
+      step go last """
+    return self.with_totals().order_by(
+      models.Case(models.When(next_step_date__isnull=True, then=1), default=0,
+                  output_field=models.IntegerField()),
+      'next_step_date', 'firstname', 'lastname')
+
+  def set_estimates(self, estimates, batch_size=100):
+    """ Set amount & likelihood on these donors, one UPDATE per batch
+
+      Like update(), doesn't send signals
+
+      Args:
+        estimates: dict of donor pk -> (amount, likelihood)
+        batch_size: max donors per UPDATE
+
+      Returns:
+        number of donors updated
+    """
+    updated = 0
+    donor_ids = sorted(estimates)
+    for start in range(0, len(donor_ids), batch_size):
+      batch = donor_ids[start:start + batch_size]
+
+      def value_for(index):
+        return models.Case(
+          *[models.When(pk=donor_id, then=models.Value(estimates[donor_id][index]))
+            for donor_id in batch],
+          output_field=models.PositiveIntegerField())
+
+      updated += self.filter(pk__in=batch).update(amount=value_for(0),
+                                                  likelihood=value_for(1))
+    return updated
+
+  def update_next_steps(self, batch_size=100):
+    """ Point next_step & next_step_date at each donor's earliest incomplete step
+
+      Called when a step is saved or deleted (see step_changed). Anything that
+      writes steps without sending signals (bulk_create, update) should call it.
+      Only donors whose next step changed are written, one UPDATE per batch.
+
+      Args:
+        batch_size: max donors per UPDATE
+
+      Returns:
+        number of donors updated
+    """
+    next_steps = {}
+    steps = (Step.objects.filter(donor__in=self, completed__isnull=True)
+             .order_by('date', 'pk').values_list('donor_id', 'pk', 'date'))
+    for donor_id, step_id, date in steps:
+      next_steps.setdefault(donor_id, (step_id, date))
+
+    changed = {}
+    for donor_id, step_id, date in self.values_list('pk', 'next_step_id', 'next_step_date'):
+      new_step = next_steps.get(donor_id, (None, None))
+      if (step_id, date) != new_step:
+        changed[donor_id] = new_step
+
+    updated = 0
+    donor_ids = sorted(changed)
+    for start in range(0, len(donor_ids), batch_size):
+      batch = donor_ids[start:start + batch_size]
+
+      def value_for(index, output_field):
+        return models.Case(
+          *[models.When(pk=donor_id, then=models.Value(changed[donor_id][index]))
+            for donor_id in batch],
+          output_field=output_field)
+
+      updated += Donor.objects.filter(pk__in=batch).update(
+          next_step=value_for(0, models.IntegerField()),
+          next_step_date=value_for(1, models.DateField()))
+    return updated
+
+  def get_progress(self):
+    """ Compile fundraising progress for these donors in a single query
+
+      Contacts are counted as asked, or talked if not asked. Money received
+      is counted as received, along with any promised amount not yet received.
+      Otherwise the full promise is counted as promised.
+
+      Returns:
+        dict with contacts, talked, asked, estimated, promised and received
+    """
+    received = self.received_expression()
+    total_promised = self.total_promised_expression()
+    progress = self.aggregate(
+      contacts=models.Count('pk'),
+      talked=_count_if(asked=False, talked=True),
+      asked=_count_if(asked=True),
+      estimated=models.Sum(self.estimated_expression()),
+      received=models.Sum(received),
+      # unpaid part of promise if anything was received, else the full promise.
+      # GREATEST avoids negative intermediates (columns are unsigned in MySQL)
+      promised=models.Sum(models.Case(
+        models.When(self.has_received(),
+                    then=_Greatest(total_promised, received) - received),
+        models.When(promised__gt=0, then=total_promised),
+        default=0, output_field=models.IntegerField()))
+    )
+    # sums are None when there are no donors; MySQL division yields decimals
+    return {key: int(value or 0) for key, value in progress.iteritems()}
+
+
 class Donor(models.Model):
   LIKELY_TO_JOIN_CHOICES = choices = (
       ('', '---------'),
@@ -303,6 +577,14 @@ class Donor(models.Model):
   email = models.EmailField(max_length=100, blank=True)
   notes = models.TextField(blank=True)
 
+  # earliest incomplete step, maintained by DonorQuerySet.update_next_steps
+  next_step = models.ForeignKey('Step', null=True, blank=True, editable=False,
+                                related_name='+', on_delete=models.SET_NULL)
+  next_step_date = models.DateField(null=True, blank=True, editable=False,
+                                    db_index=True)
+
+  objects = DonorQuerySet.as_manager()
+
   class Meta:
     ordering = ['firstname', 'lastname']
 
@@ -312,6 +594,11 @@ class Donor(models.Model):
     else:
       return self.firstname
 
+  @staticmethod
+  def name_key(firstname, lastname):
+    """ Normalized name, used to detect duplicate contacts """
+    return (firstname.strip().lower(), (lastname or '').strip().lower())
+
   def estimated(self):
     if self.amount and self.likelihood:
       return int(self.amount * self.likelihood * .01)
@@ -319,18 +606,19 @@ class Donor(models.Model):
       return 0
 
   def get_next_step(self):
-    steps = self.step_set.filter(completed__isnull=True)
-    return steps[0] if steps else None
+    return self.next_step
 
   def organize_steps(self):
-    """ Set completed_steps (list) and next_step (Step) attributes on self """
+    """ Set completed_steps (list) on self and mark whether next_step is overdue.
+      Uses prefetched steps if available """
     self.completed_steps = []
     for step in self.step_set.all():
       if step.completed:
         self.completed_steps.append(step)
-      else:
+      elif step.pk == self.next_step_id:
         self.next_step = step
-        self.next_step.overdue = self.next_step.date < timezone.localtime(timezone.now()).date()
+    if self.next_step:
+      self.next_step.overdue = self.next_step.date < timezone.localtime(timezone.now()).date()
     self.completed_steps.sort(key=lambda s: s.date)
 
   def promise_reason_display(self):
@@ -437,3 +725,54 @@ class SurveyResponse(models.Model):
   def __unicode__(self):
     return u'Response to {} {:%m/%d/%y} survey'.format(
         self.gp_survey.giving_project.title, self.date)
+
+
+# Keep cached progress (see progress.py) in sync with donor and step changes.
+# Raw saves are from loading fixtures, where related objects may not exist yet
+
+# pks of donors being deleted by this thread. pre_delete is sent for the whole
+# cascade before anything is deleted, so step_changed can skip their steps
+_deleting = threading.local()
+
+def _deleting_donors():
+  if not hasattr(_deleting, 'donor_ids'):
+    _deleting.donor_ids = set()
+  return _deleting.donor_ids
+
+@receiver(pre_delete, sender=Donor)
+def donor_deleting(sender, instance, **kwargs):
+  _deleting_donors().add(instance.pk)
+
+@receiver([post_save, post_delete], sender=Donor)
+def donor_changed(sender, instance, raw=False, **kwargs):
+  _deleting_donors().discard(instance.pk)
+  if not raw:
+    invalidate_progress(instance.membership_id, instance.membership.giving_project_id)
+
+@receiver([post_save, post_delete], sender=Step)
+def step_changed(sender, instance, raw=False, **kwargs):
+  if not raw and instance.donor_id not in _deleting_donors():
+    donor = Donor.objects.filter(pk=instance.donor_id)
+    donor.update_next_steps()
+    # ids only, rather than loading the donor and membership
+    ids = donor.values_list('membership_id', 'membership__giving_project_id').first()
+    if ids: # None if the donor no longer exists
+      invalidate_progress(*ids)
+
+@receiver(post_save, sender=GivingProject)
+def project_changed(sender, instance, raw=False, **kwargs):
+  # fund goal is used in project progress, site_visits in block content
+  if not raw:
+    invalidate_project_progress(instance.pk)
+    invalidate_project_blocks(instance.pk)
+    invalidate_membership_ids(instance.membership_set.values_list('member_id', 'pk'))
+
+@receiver([post_save, post_delete], sender=Membership)
+def membership_changed(sender, instance, raw=False, **kwargs):
+  if not raw:
+    invalidate_memberships([instance])
+
+@receiver([post_save, post_delete], sender=NewsItem)
+def news_changed(sender, instance, raw=False, **kwargs):
+  if not raw:
+    invalidate_project_blocks(instance.membership.giving_project_id)
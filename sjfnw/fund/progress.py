@@ -0,0 +1,50 @@
+""" Cached progress snapshots for memberships and giving projects
+
+  Progress is computed on a cache miss and stored until a donor or step
+  belonging to the membership is saved or deleted (see receivers in models.py).
+  Uses the default cache; see CACHES in settings.
+"""
+import logging
+
+from django.core.cache import cache
+
+logger = logging.getLogger('sjfnw')
+
+# invalidation is explicit, so this is just an upper bound
+CACHE_TIMEOUT = 60 * 60 * 24
+
+def _membership_key(membership_id):
+  return 'fund-progress-membership-{}'.format(membership_id)
+
+def _project_key(project_id):
+  return 'fund-progress-project-{}'.format(project_id)
+
+def _get_or_compute(key, compute):
+  progress = cache.get(key)
+  if progress is None:
+    progress = compute()
+    cache.set(key, progress, CACHE_TIMEOUT)
+  return progress
+
+def get_membership_progress(membership_id, compute):
+  """ Get a membership's progress dict from the cache
+
+    Args:
+      membership_id: pk of Membership
+      compute: function that returns the progress dict, called on cache miss
+  """
+  return _get_or_compute(_membership_key(membership_id), compute)
+
+def get_project_progress(project):
+  """ Get GivingProject.get_progress() from the cache """
+  return _get_or_compute(_project_key(project.pk), project.get_progress)
+
+def invalidate_progress(membership_id, project_id):
+  """ Clear cached progress for a membership and its giving project
+
+    Takes ids so callers (e.g. signal receivers) don't need to load objects
+  """
+  cache.delete_many([_membership_key(membership_id), _project_key(project_id)])
+
+def invalidate_project_progress(project_id):
+  cache.delete(_project_key(project_id))
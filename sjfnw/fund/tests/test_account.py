@@ -1,9 +1,14 @@
 from datetime import timedelta
 import logging
 
+from django.core.cache import cache
 from django.core.urlresolvers import reverse
+from django.db import connection
+from django.db.models.signals import post_save
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
 
+from sjfnw.fund import membership_cache
 from sjfnw.fund.models import Member, Membership, GivingProject
 from sjfnw.fund.tests.base import BaseFundTestCase
 
@@ -187,3 +192,88 @@ class Blocked(BaseFundTestCase):
 
     self.assertEqual(res.status_code, 200)
     self.assertTemplateUsed(res, 'fund/blocked.html')
+
+
+class CurrentMembershipCache(BaseFundTestCase):
+
+  url = reverse('sjfnw.fund.views.grant_list')
+
+  def setUp(self):
+    super(CurrentMembershipCache, self).setUp()
+    self.login_as_member('new')
+    self.key = membership_cache._membership_key(self.member_id, self.pre_id)
+
+  def get_membership_queries(self):
+    with CaptureQueriesContext(connection) as queries:
+      res = self.client.get(self.url)
+    self.assertEqual(res.status_code, 200)
+    return [q['sql'] for q in queries if 'FROM "fund_membership"' in q['sql']]
+
+  def test_cached(self):
+    membership_queries = self.get_membership_queries()
+    self.assertEqual(len(membership_queries), 1)
+    self.assertIn('"fund_givingproject"', membership_queries[0])
+
+    self.assertEqual(self.get_membership_queries(), [])
+
+  def test_approval(self):
+    Membership.objects.filter(pk=self.pre_id).update(approved=False)
+    res = self.client.get(self.url)
+    self.assertEqual(res.url, self.BASE_URL + reverse('sjfnw.fund.views.not_approved'))
+
+    membership = Membership.objects.get(pk=self.pre_id)
+    membership.approved = True
+    membership.save()
+
+    self.assertIsNone(cache.get(self.key))
+    res = self.client.get(self.url)
+    self.assertEqual(res.status_code, 200)
+
+  def test_admin_approve(self):
+    Membership.objects.filter(pk=self.pre_id).update(approved=False)
+    self.client.get(self.url)
+    self.assertFalse(cache.get(self.key).approved)
+
+    self.login_as_admin()
+    self.client.post(reverse('admin:fund_membership_changelist'), {
+      'action': 'approve', '_selected_action': [self.pre_id]
+    })
+
+    self.assertIsNone(cache.get(self.key))
+
+  def test_set_current(self):
+    self.client.get(self.url)
+
+    res = self.client.get(reverse('sjfnw.fund.views.set_current',
+                                  kwargs={'ship_id': self.post_id}))
+    self.assertEqual(res.status_code, 302)
+
+    res = self.client.get(self.url)
+    self.assertEqual(res.context['membership'].pk, self.post_id)
+
+  def test_project_saved(self):
+    self.client.get(self.url)
+
+    project = Membership.objects.get(pk=self.pre_id).giving_project
+    project.title = 'New title'
+    project.save()
+
+    self.assertIsNone(cache.get(self.key))
+    res = self.client.get(self.url)
+    self.assertEqual(res.context['membership'].giving_project.title, 'New title')
+
+  def test_project_saved_queries(self):
+    """ Memberships are invalidated by id, without loading them """
+    project = Membership.objects.get(pk=self.pre_id).giving_project
+    with self.assertNumQueries(2): # update and membership ids
+      project.save()
+
+  def test_project_loaded_raw(self):
+    """ Fixture loading doesn't touch the cache or query memberships """
+    self.client.get(self.url)
+    project = Membership.objects.get(pk=self.pre_id).giving_project
+
+    with self.assertNumQueries(0):
+      post_save.send(GivingProject, instance=project, created=False, raw=True)
+
+    self.assertIsNotNone(cache.get(self.key))
@@ -1,8 +1,9 @@
 import logging
 
+from django.core.cache import cache
 from django.core.urlresolvers import reverse
 
-from sjfnw.fund import models
+from sjfnw.fund import models, progress
 from sjfnw.fund.tests.base import BaseFundTestCase
 
 logger = logging.getLogger('sjfnw')
@@ -122,3 +123,33 @@ class AddEstimates(BaseFundTestCase):
     self.assertRegexpMatches(errors[0]['likelihood'][0], 'Enter a whole number')
     self.assertRegexpMatches(errors[1]['amount'][0], 'Must be greater than')
     self.assertRegexpMatches(errors[1]['likelihood'][0], 'Ensure this value is less than')
+
+  def test_other_members_donor(self):
+    other = models.Donor.objects.exclude(membership__member_id=self.member_id)[0]
+    form_data = self.base_form_data.copy()
+    form_data['form-0-amount'] = u'200'
+    form_data['form-0-likelihood'] = u'30'
+    form_data['form-1-donor'] = unicode(other.pk)
+    form_data['form-1-amount'] = u'500'
+    form_data['form-1-likelihood'] = u'10'
+
+    response = self.client.post(self.post_url, form_data)
+
+    self.assertEqual(response.status_code, 400)
+    self.assertIsNone(models.Donor.objects.get(pk=self.donor_id1).amount)
+    self.assertEqual(models.Donor.objects.get(pk=other.pk).amount, other.amount)
+
+  def test_progress_invalidated(self):
+    membership = models.Membership.objects.get(pk=models.Member.objects.get(
+        pk=self.member_id).current)
+    key = progress._membership_key(membership.pk)
+    cache.set(key, {'estimated': 0})
+    form_data = self.base_form_data.copy()
+    form_data['form-0-amount'] = u'200'
+    form_data['form-0-likelihood'] = u'50'
+    form_data['form-1-amount'] = u'100'
+    form_data['form-1-likelihood'] = u'10'
+
+    self.client.post(self.post_url, form_data)
+
+    self.assertIsNone(cache.get(key))
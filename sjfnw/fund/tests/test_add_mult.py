@@ -1,8 +1,16 @@
 # encoding: utf8
 
+from django.conf import settings
+from django.core.files.uploadedfile import SimpleUploadedFile
 from django.core.urlresolvers import reverse
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 
-from sjfnw.fund import models
+from google.appengine.api import blobstore, datastore
+from google.appengine.ext import testbed
+from google.appengine.ext.blobstore import BlobInfo
+
+from sjfnw.fund import models, views
 from sjfnw.fund.tests.base import BaseFundTestCase
 
 class AddMultipleDonorsPre(BaseFundTestCase):
@@ -84,6 +92,59 @@ class AddMultipleDonorsPre(BaseFundTestCase):
     donors = models.Donor.objects.filter(membership_id=self.pre_id)
     self.assertEqual(len(donors), 0)
 
+  def test_duplicates(self):
+    models.Donor.objects.create(membership_id=self.pre_id, firstname='Seattle',
+                                lastname='Washington')
+    models.Donor.objects.create(membership_id=self.pre_id, firstname='Mononym')
+    self.form_data['form-0-firstname'] = u'seattle '
+    self.form_data['form-0-lastname'] = u'WASHINGTON'
+    self.form_data['form-1-firstname'] = u'Mononym'
+    self.form_data['form-2-firstname'] = u'Seattle'
+
+    response = self.client.post(self.url, self.form_data, follow=True)
+
+    self.assertTemplateUsed(response, 'fund/forms/add_contacts.html')
+    initial = response.context['formset'].initial
+    self.assertEqual([row['firstname'] for row in initial], [u'seattle ', u'Mononym'])
+    self.assertEqual(initial[0]['confirm'], u'1')
+
+    # non-duplicate was saved
+    donors = models.Donor.objects.filter(membership_id=self.pre_id)
+    self.assertEqual(len(donors), 3)
+
+  def test_duplicate_confirmed(self):
+    models.Donor.objects.create(membership_id=self.pre_id, firstname='Mononym')
+    self.form_data['form-0-firstname'] = u'Mononym'
+    self.form_data['form-0-confirm'] = u'1'
+
+    response = self.client.post(self.url, self.form_data, follow=True)
+
+    self.assertEqual(response.content, 'success')
+    self.assertEqual(models.Donor.objects.filter(firstname='Mononym').count(), 2)
+
+  def post_contacts(self, count):
+    form_data = {
+      'form-TOTAL_FORMS': unicode(count),
+      'form-INITIAL_FORMS': u'0',
+      'form-MAX_NUM_FORMS': u'1000'
+    }
+    for i in range(count):
+      form_data['form-%d-firstname' % i] = u'Contact'
+      form_data['form-%d-lastname' % i] = unicode(i)
+    with CaptureQueriesContext(connection) as queries:
+      response = self.client.post(self.url, form_data)
+    self.assertEqual(response.content, 'success')
+    return len(queries)
+
+  def test_query_count(self):
+    few = self.post_contacts(3)
+    models.Donor.objects.all().delete()
+    many = self.post_contacts(40)
+
+    self.assertEqual(few, many)
+    self.assertEqual(models.Donor.objects.filter(membership_id=self.pre_id).count(), 40)
+
+
 class AddMultipleDonorsPost(BaseFundTestCase):
 
   url = reverse('sjfnw.fund.views.add_mult')
@@ -196,3 +257,127 @@ class AddMultipleDonorsPost(BaseFundTestCase):
 
     donors = models.Donor.objects.filter(membership_id=self.post_id)
     self.assertEqual(len(donors), 0)
+
+
+class ImportContacts(BaseFundTestCase):
+
+  url = reverse('sjfnw.fund.views.import_contacts')
+
+  def setUp(self):
+    super(ImportContacts, self).setUp()
+    self.login_as_member('new')
+    self.testbed = testbed.Testbed()
+    self.testbed.activate()
+    self.testbed.init_datastore_v3_stub()
+    self.testbed.init_blobstore_stub()
+    self.blob_count = 0
+
+  def tearDown(self):
+    self.testbed.deactivate()
+
+  def post_file(self, content, name='contacts.csv'):
+    """ Store content in the blobstore and post its key, as the blobstore
+      does after receiving an upload """
+    self.blob_count += 1
+    key = 'contactsblob{}'.format(self.blob_count)
+    entity = datastore.Entity(blobstore.BLOB_INFO_KIND, name=key, namespace='')
+    entity['size'] = len(content)
+    entity['filename'] = name
+    entity['content_type'] = 'text/csv'
+    datastore.Put(entity)
+    self.testbed.get_stub('blobstore').storage.CreateBlob(key, content)
+
+    upload = SimpleUploadedFile(name, 'blob-key=' + key)
+    return self.client.post(self.url, {'contacts_file': upload})
+
+  def test_get(self):
+    response = self.client.get(self.url)
+    self.assertTemplateUsed(response, 'fund/forms/import_contacts.html')
+    self.assertIn('_ah/upload', response.context['upload_url'])
+
+  def test_blob_deleted(self):
+    self.post_file('First name,Last name\nAngela,Davis\n')
+
+    self.assertIsNone(BlobInfo.get('contactsblob1'))
+
+  def test_too_large(self):
+    row = 'Angela,Davis\n'
+    content = 'First name,Last name\n' + row * (settings.FILE_UPLOAD_MAX_MEMORY_SIZE / len(row) + 1)
+    upload = SimpleUploadedFile('contacts.csv', content, content_type='text/csv')
+
+    response = self.client.post(self.url, {'contacts_file': upload})
+
+    self.assertTemplateUsed(response, 'fund/forms/import_contacts.html')
+    self.assertEqual(response.context['upload_error'], views.IMPORT_TOO_LARGE)
+    self.assertEqual(models.Donor.objects.filter(membership_id=self.pre_id).count(), 0)
+
+  def test_not_via_blobstore(self):
+    upload = SimpleUploadedFile('contacts.csv', 'First name,Last name\nAngela,Davis\n',
+                                content_type='text/csv')
+
+    response = self.client.post(self.url, {'contacts_file': upload})
+
+    self.assertTemplateUsed(response, 'fund/forms/import_contacts.html')
+    self.assertEqual(response.context['upload_error'], views.IMPORT_REJECTED)
+    self.assertEqual(models.Donor.objects.filter(membership_id=self.pre_id).count(), 0)
+
+  def test_csv(self):
+    response = self.post_file('First name,Last name\nAngela,Davis\nBayard,\n')
+
+    self.assertRedirects(response, reverse('sjfnw.fund.views.home'))
+    donors = models.Donor.objects.filter(membership_id=self.pre_id).order_by('firstname')
+    self.assertEqual([(d.firstname, d.lastname) for d in donors],
+                     [(u'Angela', u'Davis'), (u'Bayard', u'')])
+
+  def test_tsv_with_estimates(self):
+    member = models.Member.objects.get(pk=self.member_id)
+    member.current = self.post_id
+    member.save()
+
+    response = self.post_file('firstname\tlastname\tamount\tlikelihood\n'
+                              'Audre\tLorde\t100\t50\n', name='contacts.tsv')
+
+    self.assertRedirects(response, reverse('sjfnw.fund.views.home'))
+    donor = models.Donor.objects.get(membership_id=self.post_id)
+    self.assertEqual(donor.firstname, u'Audre')
+    self.assertEqual(donor.amount, 100)
+    self.assertEqual(donor.likelihood, 50)
+
+  def test_missing_column(self):
+    response = self.post_file('Name,Email\nAngela,a@gmail.com\n')
+
+    self.assertTemplateUsed(response, 'fund/forms/import_contacts.html')
+    self.assertIn('contacts_file', response.context['form'].errors)
+    self.assertEqual(models.Donor.objects.filter(membership_id=self.pre_id).count(), 0)
+
+  def test_invalid_row(self):
+    response = self.post_file('firstname,lastname\nAngela,Davis\n,Rustin\n')
+
+    self.assertTemplateUsed(response, 'fund/forms/import_contacts.html')
+    self.assertEqual(len(response.context['row_errors']), 1)
+    self.assertEqual(models.Donor.objects.filter(membership_id=self.pre_id).count(), 0)
+
+  def test_duplicates(self):
+    models.Donor.objects.create(membership_id=self.pre_id, firstname='Angela', lastname='Davis')
+
+    response = self.post_file('firstname,lastname\nangela,davis \nBayard,Rustin\n'
+                              'Bayard,Rustin\n')
+
+    self.assertTemplateUsed(response, 'fund/forms/add_contacts.html')
+    self.assertEqual(response.context['post_url'], reverse('sjfnw.fund.views.add_mult'))
+    initial = response.context['formset'].initial
+    self.assertEqual([(row['firstname'], row['confirm']) for row in initial],
+                     [(u'angela', u'1'), (u'Bayard', u'1')])
+    self.assertEqual(models.Donor.objects.filter(membership_id=self.pre_id).count(), 2)
+
+  def test_query_count(self):
+    rows = ['firstname,lastname'] + ['First{0},Last{0}'.format(i) for i in range(40)]
+    with CaptureQueriesContext(connection) as queries:
+      self.post_file('\n'.join(rows))
+    self.assertEqual(models.Donor.objects.filter(membership_id=self.pre_id).count(), 40)
+
+    models.Donor.objects.filter(membership_id=self.pre_id).delete()
+    with CaptureQueriesContext(connection) as fewer_queries:
+      self.post_file('\n'.join(rows[:6]))
+
+    self.assertEqual(len(queries), len(fewer_queries))
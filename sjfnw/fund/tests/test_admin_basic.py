@@ -1,5 +1,12 @@
-import logging
+from datetime import timedelta
+import json, logging
 
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from sjfnw.fund.models import (Donor, GivingProject, GPSurvey, Member, Membership,
+    Step, Survey, SurveyResponse)
 from sjfnw.fund.tests.base import BaseFundTestCase
 
 logger = logging.getLogger('sjfnw')
@@ -44,6 +51,27 @@ class AdminGivingProjects(BaseFundTestCase):
     self.assertEqual(response.context['module_name'], u'giving projects')
     self.assertIn('choices', response.context)
 
+  def test_estimated_query_count(self):
+    url = '/admin/fund/givingproject/'
+    with CaptureQueriesContext(connection) as queries:
+      self.client.get(url)
+
+    for project in GivingProject.objects.all():
+      membership = Membership.objects.filter(giving_project=project).first()
+      if membership:
+        Donor.objects.create(membership=membership, firstname='Estimated',
+                             amount=300, likelihood=50)
+    GivingProject.objects.create(title='Another project',
+                                 fundraising_training=timezone.now(),
+                                 fundraising_deadline=timezone.now())
+
+    with CaptureQueriesContext(connection) as more_queries:
+      response = self.client.get(url)
+
+    self.assertEqual(len(queries), len(more_queries))
+    for project in response.context['cl'].result_list:
+      self.assertEqual(int(project.estimated_total or 0), project.estimated())
+
 
 class AdminMembershipRelated(BaseFundTestCase):
 
@@ -64,12 +92,65 @@ class AdminMembershipRelated(BaseFundTestCase):
     self.assertEqual(response.context['module_name'], u'memberships')
     self.assertIn('choices', response.context)
 
+  def test_memberships_delete(self):
+    member = Member.objects.create_with_user(email='another@gmail.com', password='pass',
+                                             first_name='Another', last_name='Member')
+    membership = Membership.objects.create(member=member,
+                                           giving_project=GivingProject.objects.first())
+    Donor.objects.create(membership=membership, firstname='Deleted')
+    self.client.post('/admin/fund/membership/', {
+      'action': 'delete_selected', '_selected_action': [membership.pk], 'post': 'yes'
+    })
+    self.assertFalse(Membership.objects.filter(pk=membership.pk).exists())
+
+  def test_memberships_query_count(self):
+    url = '/admin/fund/membership/'
+    with CaptureQueriesContext(connection) as queries:
+      self.client.get(url)
+
+    member = Member.objects.create_with_user(email='another@gmail.com', password='pass',
+                                             first_name='Another', last_name='Member')
+    for project in GivingProject.objects.all()[:3]:
+      membership = Membership.objects.create(member=member, giving_project=project)
+      donor = Donor.objects.create(membership=membership, firstname='Progress',
+                                   amount=100, likelihood=50, promised=100, received_this=20)
+      Step.objects.create(donor=donor, date=timezone.now() - timedelta(days=5),
+                          description='Overdue')
+
+    with CaptureQueriesContext(connection) as more_queries:
+      self.client.get(url)
+
+    self.assertEqual(len(queries), len(more_queries))
+
   def test_donors(self):
     response = self.client.get('/admin/fund/donor/', follow=True)
     self.assertEqual(response.status_code, 200)
     self.assertEqual(response.context['module_name'], u'donors')
     self.assertIn('choices', response.context)
 
+  def test_export_donors(self):
+    member = Member.objects.create_with_user(email='another@gmail.com', password='pass',
+                                             first_name='Another', last_name='Member')
+    memberships = [Membership.objects.create(member=member, giving_project=project)
+                   for project in GivingProject.objects.all()[:3]]
+    for i, membership in enumerate(memberships):
+      Donor.objects.create(membership=membership, firstname='Export{}'.format(i),
+                           amount=100, likelihood=50, promised=100, received_this=20)
+    donor_ids = Donor.objects.values_list('pk', flat=True)
+
+    with CaptureQueriesContext(connection) as queries:
+      response = self.client.post('/admin/fund/donor/', {
+        'action': 'export_donors', '_selected_action': donor_ids
+      })
+      lines = list(response.streaming_content)
+
+    self.assertEqual(response['Content-Type'], 'text/csv')
+    self.assertEqual(len(lines), len(donor_ids) + 1)
+    header = lines[0].split(',')
+    self.assertEqual(len(lines[1].split(',')), len(header))
+    select_queries = [q for q in queries if 'fund_donor' in q['sql']]
+    self.assertLessEqual(len(select_queries), 3)
+
 
 class AdminResources(BaseFundTestCase):
 
@@ -113,3 +194,21 @@ class AdminMisc(BaseFundTestCase):
     self.assertEqual(response.status_code, 200)
     self.assertEqual(response.context['module_name'], u'survey responses')
     self.assertIn('choices', response.context)
+
+  def test_export_survey_responses(self):
+    survey = Survey.objects.create(title='Session eval', questions='[]')
+    gp_survey = GPSurvey.objects.create(survey=survey, date=timezone.now(),
+                                        giving_project=GivingProject.objects.first())
+    SurveyResponse.objects.create(gp_survey=gp_survey, responses=json.dumps(['Q1', 'A1']))
+    SurveyResponse.objects.create(gp_survey=gp_survey,
+                                  responses=json.dumps(['Q1', 'A1', 'Q2', 'A2', 'Q3', 'A3']))
+    response_ids = SurveyResponse.objects.values_list('pk', flat=True)
+
+    response = self.client.post('/admin/fund/surveyresponse/', {
+      'action': 'export_responses', '_selected_action': response_ids
+    })
+    lines = [line.strip() for line in response.streaming_content]
+
+    self.assertEqual(len(lines), 3)
+    self.assertTrue(lines[0].endswith('Question,Answer,Question,Answer,Question,Answer'))
+    self.assertTrue(any(line.endswith('Session eval,Q1,A1,Q2,A2,Q3,A3') for line in lines))
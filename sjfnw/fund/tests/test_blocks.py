@@ -0,0 +1,79 @@
+from django.core.urlresolvers import reverse
+
+from mock import patch
+
+from sjfnw.fund import models, views
+from sjfnw.fund.tests.base import BaseFundTestCase
+from sjfnw.grants.tests import factories
+
+
+class ProjectBlocksCache(BaseFundTestCase):
+
+  url = reverse('sjfnw.fund.views.grant_list')
+
+  def setUp(self):
+    super(ProjectBlocksCache, self).setUp()
+    self.login_as_member('current')
+    self.membership = models.Membership.objects.get(pk=self.ship_id)
+    self.project_app = factories.ProjectApp(giving_project=self.membership.giving_project,
+                                            screening_status=70)
+
+  def test_cached(self):
+    self.client.get(self.url)
+
+    with patch.object(views, '_compile_project_blocks') as compile_blocks:
+      res = self.client.get(self.url)
+
+    self.assertFalse(compile_blocks.called)
+    self.assertEqual(res.context['grants'], [self.project_app])
+
+  def test_shared_by_project(self):
+    self.client.get(self.url)
+
+    member = models.Member.objects.create_with_user(email='other@gmail.com', password='pass',
+                                                    first_name='Other', last_name='Member')
+    other = models.Membership.objects.create(
+        member=member, giving_project=self.membership.giving_project, approved=True)
+    with patch.object(views, '_compile_project_blocks') as compile_blocks:
+      views._get_block_content(other)
+
+    self.assertFalse(compile_blocks.called)
+
+  def test_steps_not_cached(self):
+    self.client.get(self.url)
+
+    step = models.Step.objects.create(donor_id=self.donor_id, date='2034-11-13',
+                                      description='New step')
+    res = self.client.get(self.url)
+
+    self.assertIn(step, res.context['steps'])
+
+  def test_news_saved(self):
+    self.client.get(self.url)
+
+    news = models.NewsItem.objects.create(membership=self.membership, summary='News!')
+    res = self.client.get(self.url)
+
+    self.assertIn(news, res.context['news'])
+
+  def test_screening_status_changed(self):
+    self.client.get(self.url)
+
+    self.project_app.screening_status = 130 # closed
+    self.project_app.save()
+    res = self.client.get(self.url)
+
+    self.assertEqual(res.context['grants'], [])
+
+  def test_site_visits_toggled(self):
+    self.project_app.screening_status = 60
+    self.project_app.save()
+    res = self.client.get(self.url)
+    self.assertEqual(res.context['grants'], [self.project_app])
+
+    project = self.membership.giving_project
+    project.site_visits = True
+    project.save()
+    res = self.client.get(self.url)
+
+    self.assertEqual(res.context['grants'], [])
@@ -3,9 +3,13 @@ import logging
 
 from django.core import mail
 from django.core.urlresolvers import reverse
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
 
-from sjfnw.fund import models
+from mock import patch
+
+from sjfnw.fund import cron, models
 from sjfnw.fund.tests.base import BaseFundTestCase
 
 logger = logging.getLogger('sjfnw')
@@ -95,6 +99,52 @@ class GiftNotifications(BaseFundTestCase):
     self.assertTemplateUsed(response, 'fund/home.html')
     self.assertContains(response, 'gift or pledge received')
 
+  def test_query_count(self):
+    """ Number of queries does not depend on number of memberships notified """
+    models.Donor.objects.filter(pk=self.donor_id).update(received_this=100)
+    with CaptureQueriesContext(connection) as queries:
+      self.client.get(self.cron_url)
+    self.assertEqual(len(mail.outbox), 1)
+    expected = len(queries)
+
+    models.Donor.objects.filter(pk=self.donor_id).update(gift_notified=False)
+    for i in range(3):
+      member = models.Member.objects.create_with_user(
+          email='gift{}@gmail.com'.format(i), password='pass', first_name='A', last_name='B')
+      membership = models.Membership.objects.create(member=member, giving_project_id=1)
+      for j in range(2):
+        models.Donor.objects.create(membership=membership, firstname='Donor{}'.format(j),
+                                    received_next=10)
+
+    with CaptureQueriesContext(connection) as queries:
+      self.client.get(self.cron_url)
+    self.assertEqual(len(mail.outbox), 5)
+    self.assertEqual(len(queries), expected)
+    self.assertFalse(models.Donor.objects.filter(gift_notified=False)
+                                         .exclude(received_this=0, received_next=0,
+                                                  received_afternext=0)
+                                         .exists())
+
+  @patch.object(cron, 'gift_stage', side_effect=ValueError('Oops'))
+  def test_stage_failed(self, _):
+    response = self.client.get(self.cron_url)
+
+    self.assertEqual(response.status_code, 500)
+    self.assertEqual(len(mail.outbox), 0)
+
+  def test_only_processed_marked(self):
+    donor = models.Donor.objects.get(pk=self.donor_id)
+    donor.received_this = 100
+    donor.save()
+    other = models.Donor.objects.create(membership_id=donor.membership_id, firstname='None yet')
+
+    self.client.get(self.cron_url)
+
+    self.assertTrue(models.Donor.objects.get(pk=self.donor_id).gift_notified)
+    self.assertFalse(models.Donor.objects.get(pk=other.pk).gift_notified)
+    membership = models.Membership.objects.get(pk=donor.membership_id)
+    self.assertIn(unicode(donor), membership.notifications)
+
 
 class PendingApproval(BaseFundTestCase):
 
@@ -215,6 +265,36 @@ class PendingApproval(BaseFundTestCase):
     self.assertEqual(response.status_code, 200)
     self.assertEqual(len(mail.outbox), 1)
 
+  def test_query_count(self):
+    """ Number of queries does not depend on number of giving projects """
+    pre_gp = models.GivingProject.objects.get(title='Pre training')
+    member = models.Member.objects.create_with_user(
+        email='abcde@fgh.com', first_name='Ab', last_name='Cd')
+    models.Membership.objects.create(giving_project=pre_gp, member=member)
+
+    with CaptureQueriesContext(connection) as queries:
+      self.client.get(self.url)
+    self.assertEqual(len(mail.outbox), 1)
+    expected = len(queries)
+
+    for i in range(3):
+      gp = models.GivingProject.objects.create(
+          title='Project {}'.format(i), fundraising_training=timezone.now(),
+          fundraising_deadline=timezone.now() + timedelta(days=30))
+      leader = models.Member.objects.create_with_user(
+          email='leader{}@gmail.com'.format(i), first_name='Lea', last_name='Der')
+      models.Membership.objects.create(giving_project=gp, member=leader, leader=True,
+                                       approved=True)
+      member = models.Member.objects.create_with_user(
+          email='new{}@gmail.com'.format(i), first_name='N', last_name='Ew')
+      models.Membership.objects.create(giving_project=gp, member=member)
+
+    with CaptureQueriesContext(connection) as queries:
+      self.client.get(self.url)
+    self.assertEqual(len(mail.outbox), 5)
+    self.assertEqual(len(queries), expected)
+    self.assertEqual(mail.outbox[-1].to, ['leader2@gmail.com'])
+
 
 class OverdueEmails(BaseFundTestCase):
 
@@ -242,6 +322,7 @@ class OverdueEmails(BaseFundTestCase):
     donor = models.Donor(firstname='Tre', membership=membership)
     donor.save()
     self.donor3 = donor.pk
+    self.donor3_ship = membership.pk
 
   def test_none(self):
     self.assertEqual(len(mail.outbox), 0)
@@ -309,3 +390,44 @@ class OverdueEmails(BaseFundTestCase):
     response = self.client.get(self.url, follow=True)
     self.assertEqual(response.status_code, 200)
     self.assertEqual(len(mail.outbox), 0)
+
+  def test_most_recent_step(self):
+    """ Email has count of overdue steps and the most recent one """
+    step = models.Step(donor_id=self.donor1, date=timezone.now() - timedelta(days=9),
+                       description='Older')
+    step.save()
+    step = models.Step(donor_id=self.donor2, date=timezone.now() - timedelta(days=3),
+                       description='Recent')
+    step.save()
+
+    self.client.get(self.url)
+
+    self.assertEqual(len(mail.outbox), 1)
+    self.assertIn('several overdue fundraising steps', mail.outbox[0].body)
+    self.assertIn('Recent', mail.outbox[0].body)
+    self.assertNotIn('Older', mail.outbox[0].body)
+
+  def test_query_count(self):
+    """ Number of queries does not depend on number of memberships emailed """
+    step = models.Step(donor_id=self.donor1, date=timezone.now() - timedelta(days=3))
+    step.save()
+    with CaptureQueriesContext(connection) as queries:
+      self.client.get(self.url)
+    self.assertEqual(len(mail.outbox), 1)
+    expected = len(queries)
+
+    models.Membership.objects.update(emailed=None)
+    step = models.Step(donor_id=self.donor3, date=timezone.now() - timedelta(days=9))
+    step.save()
+    donor = models.Donor(membership_id=self.post_id, firstname='Other')
+    donor.save()
+    step = models.Step(donor=donor, date=timezone.now() - timedelta(days=5))
+    step.save()
+
+    with CaptureQueriesContext(connection) as queries:
+      self.client.get(self.url)
+    self.assertEqual(len(mail.outbox), 4)
+    self.assertEqual(len(queries), expected)
+    emailed = models.Membership.objects.filter(emailed__isnull=False)
+    self.assertEqual(set(emailed.values_list('pk', flat=True)),
+                     {self.pre_id, self.post_id, self.donor3_ship})
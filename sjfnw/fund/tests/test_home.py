@@ -2,7 +2,7 @@ from django.core.urlresolvers import reverse
 from django.utils import timezone
 
 from sjfnw.fund import models
-from sjfnw.fund.views import _compile_membership_progress
+from sjfnw.fund.views import _compile_membership_progress, _organize_donors
 from sjfnw.fund.tests.base import BaseFundTestCase
 
 class AddContacts(BaseFundTestCase):
@@ -142,10 +142,11 @@ class HomeSurveys(BaseFundTestCase):
 
 
 class CompileMembershipProgress(BaseFundTestCase):
-  """ Test _compile_membership_progress method used by home view """
+  """ Test _compile_membership_progress and _organize_donors methods used by home view """
 
   def test_empty(self):
-    progress, incomplete_steps = _compile_membership_progress([])
+    progress = _compile_membership_progress(models.Donor.objects.none())
+    incomplete_steps = _organize_donors([])
 
     self.assertEqual(incomplete_steps, [])
     for _, value in progress.iteritems():
@@ -181,9 +182,11 @@ class CompileMembershipProgress(BaseFundTestCase):
     step = models.Step(donor=donor, date='2015-5-25', description='Thank')
     step.save()
 
-    donors = models.Donor.objects.filter(membership_id=ship_id).prefetch_related('step_set')
+    donors = models.Donor.objects.filter(membership_id=ship_id)
 
-    progress, incomplete_steps = _compile_membership_progress(donors)
+    progress = _compile_membership_progress(donors)
+    donors = donors.with_totals().prefetch_related('step_set')
+    incomplete_steps = _organize_donors(donors)
 
     self.assertIsInstance(progress, dict)
     self.assertEqual(progress['estimated'], 330)
@@ -197,12 +200,68 @@ class CompileMembershipProgress(BaseFundTestCase):
     self.assertEqual(progress['togo'], 30)
 
     self.assertEqual(len(incomplete_steps), 2)
+    self.assertEqual([donor.summary for donor in donors],
+                     ['', 'Asked.  $200 received by SJF.'])
     for donor in donors:
       self.assertIsInstance(donor.next_step, models.Step)
       self.assertIs(type(donor.completed_steps), list)
       self.assertTrue(len(donor.completed_steps) > 0)
 
 
+class DonorTotals(BaseFundTestCase):
+  """ Test DonorQuerySet annotations & aggregates against Donor methods """
+
+  def setUp(self):
+    super(DonorTotals, self).setUp()
+    self.login_as_member('new')
+    donors = [
+      models.Donor(firstname='Ann', amount=333, likelihood=33),
+      models.Donor(firstname='Bea', amount=500, likelihood=50, asked=True,
+                   promised=400, match_expected=100, received_this=200),
+      models.Donor(firstname='Cy', amount=100, likelihood=90, asked=True,
+                   promised=100, received_next=50, match_received=100),
+      models.Donor(firstname='Di', amount=250, likelihood=80, talked=True,
+                   promised=250, match_expected=250),
+      models.Donor(firstname='Ed', talked=True, asked=True, promised=0)
+    ]
+    for donor in donors:
+      donor.membership_id = self.post_id
+      donor.save()
+    self.donors = models.Donor.objects.filter(membership_id=self.post_id)
+
+  def test_with_totals(self):
+    for donor in self.donors.with_totals():
+      self.assertEqual(donor.received_total, donor.received())
+      self.assertEqual(donor.promised_total, donor.total_promised())
+      self.assertEqual(donor.estimate, donor.estimated())
+      self.assertIsNone(donor.next_step_date)
+
+  def test_get_progress(self):
+    progress = self.donors.get_progress()
+
+    self.assertEqual(progress, {
+      'contacts': 5,
+      'talked': 1,
+      'asked': 3,
+      'estimated': 109 + 250 + 90 + 200,
+      'received': 200 + 150,
+      'promised': 300 + 500
+    })
+
+  def test_order_by_next_step(self):
+    ann, bea, cy = self.donors[:3]
+    models.Step.objects.create(donor=ann, date='2015-06-01', description='Ask')
+    models.Step.objects.create(donor=bea, date='2015-05-01', description='Talk',
+                               completed=timezone.now())
+    models.Step.objects.create(donor=bea, date='2015-07-01', description='Ask')
+    models.Step.objects.create(donor=cy, date='2015-05-15', description='Thank')
+
+    donors = list(self.donors.order_by_next_step())
+
+    self.assertEqual([d.firstname for d in donors], ['Cy', 'Ann', 'Bea', 'Di', 'Ed'])
+    self.assertEqual(str(donors[2].next_step_date), '2015-07-01')
+
+
 class FormQueryParams(BaseFundTestCase):
   """
   The logic for loading the forms is in the javascript - all we can test is that
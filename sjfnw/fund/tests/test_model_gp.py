@@ -1,4 +1,4 @@
-from sjfnw.fund.models import GivingProject
+from sjfnw.fund.models import Donor, GivingProject, Member, Membership
 from sjfnw.fund.tests.base import BaseFundTestCase
 
 class GetSuggestedSteps(BaseFundTestCase):
@@ -39,3 +39,108 @@ class GetSuggestedSteps(BaseFundTestCase):
     self.assertEqual(suggested[0], 'Talk')
     self.assertEqual(suggested[1], 'Invite them')
     self.assertEqual(suggested[2], 'Thanks!!')
+
+
+def python_progress(project):
+  """ Project progress as computed by looping over donors in python """
+  progress = {'contacts': 0, 'talked': 0, 'asked': 0, 'promised': 0, 'received': 0}
+  donors = list(Donor.objects.filter(membership__giving_project=project))
+  progress['contacts'] = len(donors)
+  for donor in donors:
+    if donor.asked:
+      progress['asked'] += 1
+    elif donor.talked:
+      progress['talked'] += 1
+    if donor.received() > 0:
+      progress['received'] += donor.received()
+    elif donor.promised:
+      progress['promised'] += donor.total_promised()
+
+  progress['contacts_remaining'] = progress['contacts'] - progress['talked'] - progress['asked']
+  progress['togo'] = project.fund_goal - progress['promised'] - progress['received']
+  if progress['togo'] < 0:
+    progress['togo'] = 0
+  return progress
+
+
+class GetProgress(BaseFundTestCase):
+
+  def setUp(self):
+    super(GetProgress, self).setUp()
+    self.gp = GivingProject.objects.get(title='Post training')
+
+  def test_no_donors(self):
+    progress = self.gp.get_progress()
+    self.assertEqual(progress, python_progress(self.gp))
+    self.assertEqual(progress['contacts'], 0)
+    self.assertEqual(progress['togo'], self.gp.fund_goal)
+
+  def test_fixture_projects(self):
+    for gp in GivingProject.objects.all():
+      self.assertEqual(gp.get_progress(), python_progress(gp))
+
+  def test_mixed_donors(self):
+    member = Member.objects.create_with_user(email='progress@gmail.com', password='pass',
+                                             first_name='Pro', last_name='Gress')
+    membership = Membership.objects.create(giving_project=self.gp, member=member,
+                                           approved=True)
+    donors = [
+      {},
+      {'talked': True},
+      {'talked': True, 'asked': True},
+      {'asked': True, 'promised': 0},
+      {'asked': True, 'promised': 300},
+      {'asked': True, 'promised': 200, 'match_expected': 200},
+      {'asked': True, 'promised': 100, 'received_next': 50},
+      {'asked': True, 'promised': 100, 'match_expected': 100, 'match_received': 80},
+      {'asked': True, 'received_this': 40, 'received_afternext': 10},
+      {'talked': True, 'promised': 5000, 'received_this': 1000}
+    ]
+    for i, fields in enumerate(donors):
+      Donor.objects.create(membership=membership, firstname='Donor{}'.format(i), **fields)
+
+    progress = self.gp.get_progress()
+    self.assertEqual(progress, python_progress(self.gp))
+    self.assertEqual(progress['contacts'], 10)
+    self.assertEqual(progress['asked'], 7)
+    self.assertEqual(progress['talked'], 2)
+    self.assertEqual(progress['promised'], 700)
+    self.assertEqual(progress['received'], 1180)
+    self.assertEqual(progress['togo'], 3120)
+
+  def test_over_goal(self):
+    self.gp.fund_goal = 100
+    self.gp.save()
+    member = Member.objects.create_with_user(email='progress@gmail.com', password='pass',
+                                             first_name='Pro', last_name='Gress')
+    membership = Membership.objects.create(giving_project=self.gp, member=member,
+                                           approved=True)
+    Donor.objects.create(membership=membership, firstname='Big', asked=True,
+                         promised=500, received_this=500)
+
+    progress = self.gp.get_progress()
+    self.assertEqual(progress, python_progress(self.gp))
+    self.assertEqual(progress['togo'], 0)
+
+
+class Estimated(BaseFundTestCase):
+
+  def setUp(self):
+    super(Estimated, self).setUp()
+    self.gp = GivingProject.objects.get(title='Post training')
+
+  def test_no_donors(self):
+    self.assertEqual(self.gp.estimated(), 0)
+
+  def test_matches_donors(self):
+    member = Member.objects.create_with_user(email='estimated@gmail.com', password='pass',
+                                             first_name='Esti', last_name='Mate')
+    membership = Membership.objects.create(giving_project=self.gp, member=member,
+                                           approved=True)
+    for i, (amount, likelihood) in enumerate([(None, None), (100, 0), (150, 33), (75, 50)]):
+      Donor.objects.create(membership=membership, firstname='Donor{}'.format(i),
+                           amount=amount, likelihood=likelihood)
+
+    donors = Donor.objects.filter(membership__giving_project=self.gp)
+    self.assertEqual(self.gp.estimated(), sum(donor.estimated() for donor in donors))
+    self.assertEqual(self.gp.estimated(), 86)
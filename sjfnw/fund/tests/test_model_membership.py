@@ -1,5 +1,9 @@
+from datetime import timedelta
 import logging
 
+from django.core import mail
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
 
 from sjfnw.fund.models import Membership, Donor, Step
@@ -41,6 +45,32 @@ class GetProgress(BaseFundTestCase):
     self.assertEqual(progress['received_afternext'], 0)
     self.assertEqual(progress['received_total'], 240)
 
+  def test_with_progress(self):
+    Donor.objects.create(membership_id=self.pre_id, firstname='Sally', amount=40,
+                         likelihood=75, asked=True, promised=40, received_this=40)
+    donor = Donor.objects.create(membership_id=self.pre_id, firstname='Diego', amount=200,
+                                 likelihood=50, asked=True, promised=300, match_expected=100,
+                                 received_next=100, received_afternext=5)
+    today = timezone.now().date()
+    Step.objects.create(donor=donor, date=today - timedelta(days=3), description='Overdue')
+    Step.objects.create(donor=donor, date=today - timedelta(days=4), description='Done',
+                        completed=timezone.now())
+    Step.objects.create(donor=donor, date=today, description='Not overdue')
+
+    for membership in Membership.objects.with_progress():
+      progress = membership.get_progress()
+      self.assertEqual(membership.progress_estimated or 0, progress['estimated'])
+      self.assertEqual(membership.progress_promised or 0, progress['promised'])
+      self.assertEqual(membership.progress_received_this or 0, progress['received_this'])
+      self.assertEqual(membership.progress_received_next or 0, progress['received_next'])
+      self.assertEqual(membership.progress_received_afternext or 0,
+                       progress['received_afternext'])
+      self.assertEqual(membership.overdue_count, membership.overdue_steps())
+
+    membership = Membership.objects.with_progress().get(pk=self.pre_id)
+    self.assertEqual(membership.progress_promised, 440)
+    self.assertEqual(membership.overdue_count, 1)
+
 
 class UpdateStory(BaseFundTestCase):
 
@@ -166,3 +196,76 @@ class UpdateStory(BaseFundTestCase):
     story = stories[0]
     self.assertEqual(story.summary,
         u'{} talked to 2 people, asked 1 and got $650 in promises.'.format(self.name))
+
+  def test_asked_and_talked_same_donor(self):
+    """ Donor counts once as asked, whichever order the steps were completed """
+    now = timezone.now()
+    step = Step(donor_id=self.donor_id, date=now, description='Ask', asked=True)
+    step.completed = now
+    step.save()
+
+    step = Step(donor_id=self.donor_id, date=now, description='Follow up')
+    step.completed = now
+    step.save()
+
+    self.membership.update_story(timezone.now())
+
+    story = self.membership.newsitem_set.get()
+    self.assertEqual(story.summary, u'{} asked 1 person.'.format(self.name))
+
+
+class MembershipSave(BaseFundTestCase):
+
+  def setUp(self):
+    super(MembershipSave, self).setUp()
+    self.login_as_member('new')
+    Membership.objects.filter(pk=self.pre_id).update(approved=False)
+
+  def test_approval_email(self):
+    membership = Membership.objects.get(pk=self.pre_id)
+    membership.approved = True
+
+    membership.save()
+    self.assertEqual(len(mail.outbox), 1)
+
+    membership.save()
+    self.assertEqual(len(mail.outbox), 1)
+
+  def test_approval_skip(self):
+    membership = Membership.objects.get(pk=self.pre_id)
+    membership.approved = True
+
+    membership.save(skip=True)
+
+    self.assertEqual(len(mail.outbox), 0)
+    self.assertTrue(Membership.objects.get(pk=self.pre_id).approved)
+
+  def test_single_update(self):
+    membership = Membership.objects.get(pk=self.pre_id)
+    membership.last_activity = timezone.now().date()
+
+    with CaptureQueriesContext(connection) as queries:
+      membership.save()
+
+    self.assertEqual(len(queries), 1)
+    self.assertIn('UPDATE', queries[0]['sql'])
+    self.assertNotIn('notifications', queries[0]['sql'])
+
+  def test_unchanged(self):
+    membership = Membership.objects.get(pk=self.pre_id)
+
+    with self.assertNumQueries(0):
+      membership.save()
+
+  def test_only_changed_fields(self):
+    first = Membership.objects.get(pk=self.pre_id)
+    second = Membership.objects.get(pk=self.pre_id)
+
+    first.notifications = 'Hello'
+    first.save()
+    second.copied_contacts = True
+    second.save()
+
+    membership = Membership.objects.get(pk=self.pre_id)
+    self.assertEqual(membership.notifications, 'Hello')
+    self.assertTrue(membership.copied_contacts)
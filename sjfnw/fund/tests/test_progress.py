@@ -0,0 +1,123 @@
+from django.core.cache import cache
+from django.core.urlresolvers import reverse
+from django.utils import timezone
+
+from mock import patch
+
+from sjfnw.fund import models, progress, views
+from sjfnw.fund.tests.base import BaseFundTestCase
+
+
+class MembershipProgressCache(BaseFundTestCase):
+
+  url = reverse('sjfnw.fund.views.home')
+
+  def setUp(self):
+    super(MembershipProgressCache, self).setUp()
+    self.login_as_member('current')
+    self.key = progress._membership_key(self.ship_id)
+
+  def test_cached(self):
+    self.client.get(self.url)
+    self.assertEqual(cache.get(self.key)['contacts'], 1)
+
+    with patch.object(views, '_compile_membership_progress') as compile_progress:
+      res = self.client.get(self.url)
+
+    self.assertFalse(compile_progress.called)
+    self.assertEqual(res.context['progress']['contacts'], 1)
+
+  def test_donor_saved(self):
+    self.client.get(self.url)
+
+    donor = models.Donor.objects.get(pk=self.donor_id)
+    donor.asked = True
+    donor.save()
+
+    self.assertIsNone(cache.get(self.key))
+    res = self.client.get(self.url)
+    self.assertEqual(res.context['progress']['asked'], 1)
+
+  def test_donor_added_and_deleted(self):
+    self.client.get(self.url)
+
+    donor = models.Donor.objects.create(membership_id=self.ship_id, firstname='Bo',
+                                        amount=100, likelihood=10)
+    self.assertIsNone(cache.get(self.key))
+    res = self.client.get(self.url)
+    self.assertEqual(res.context['progress']['contacts'], 2)
+
+    donor.delete()
+    self.assertIsNone(cache.get(self.key))
+    res = self.client.get(self.url)
+    self.assertEqual(res.context['progress']['contacts'], 1)
+
+  def test_step_saved(self):
+    self.client.get(self.url)
+
+    step = models.Step.objects.get(pk=self.step_id)
+    step.completed = timezone.now()
+    step.save()
+
+    self.assertIsNone(cache.get(self.key))
+
+
+class ProjectProgressCache(BaseFundTestCase):
+
+  url = reverse('sjfnw.fund.views.project_page')
+
+  def setUp(self):
+    super(ProjectProgressCache, self).setUp()
+    self.login_as_member('current')
+    self.project = models.Membership.objects.get(pk=self.ship_id).giving_project
+    self.key = progress._project_key(self.project.pk)
+
+  def test_cached(self):
+    self.client.get(self.url)
+    self.assertEqual(cache.get(self.key)['contacts'], 1)
+
+    with patch.object(models.GivingProject, 'get_progress') as get_progress:
+      res = self.client.get(self.url)
+
+    self.assertFalse(get_progress.called)
+    self.assertEqual(res.context['project_progress']['contacts'], 1)
+
+  def test_donor_saved(self):
+    self.client.get(self.url)
+
+    donor = models.Donor.objects.get(pk=self.donor_id)
+    donor.received_this = 100
+    donor.save()
+
+    self.assertIsNone(cache.get(self.key))
+    res = self.client.get(self.url)
+    self.assertEqual(res.context['project_progress']['received'], 100)
+
+  def test_goal_changed(self):
+    self.client.get(self.url)
+
+    self.project.fund_goal = 200
+    self.project.save()
+
+    res = self.client.get(self.url)
+    self.assertEqual(res.context['project_progress']['togo'], 200)
+
+  def test_admin_list_editable(self):
+    self.client.get(self.url)
+
+    self.login_as_admin()
+    res = self.client.post(reverse('admin:fund_donor_changelist'), {
+      'form-TOTAL_FORMS': 1,
+      'form-INITIAL_FORMS': 1,
+      'form-0-id': self.donor_id,
+      'form-0-received_this': 50,
+      'form-0-received_next': 0,
+      'form-0-received_afternext': 0,
+      'form-0-match_expected': 0,
+      'form-0-match_received': 0,
+      '_save': 'Save'
+    })
+    self.assertEqual(res.status_code, 302)
+    self.assertEqual(models.Donor.objects.get(pk=self.donor_id).received_this, 50)
+
+    self.assertIsNone(cache.get(self.key))
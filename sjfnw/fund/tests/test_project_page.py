@@ -1,6 +1,8 @@
 from django.core.urlresolvers import reverse
 
+from sjfnw.fund.models import Membership
 from sjfnw.fund.tests.base import BaseFundTestCase
+from sjfnw.fund.tests.test_model_gp import python_progress
 
 class GivingProjectPage(BaseFundTestCase):
 
@@ -16,3 +18,13 @@ class GivingProjectPage(BaseFundTestCase):
 
     self.assertEqual(res.status_code, 200)
     self.assertTemplateUsed(res, 'fund/project.html')
+
+  def test_progress(self):
+    membership = Membership.objects.get(pk=self.pre_id)
+    membership.donor_set.create(firstname='Anna', talked=True)
+
+    res = self.client.get(self.url)
+
+    progress = res.context['project_progress']
+    self.assertEqual(progress, python_progress(membership.giving_project))
+    self.assertEqual(progress['talked'], 1)
@@ -1,8 +1,12 @@
 from datetime import timedelta
+from importlib import import_module
 import logging
 import unittest
 
+from django.apps import apps
 from django.core.urlresolvers import reverse
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
 
 from sjfnw.fund.models import Donor, Step, Membership
@@ -566,6 +570,47 @@ class AddMultStep(BaseFundTestCase):
     self.assertEqual(res.content, 'success')
     self.assertNotEqual(last_activity, Membership.objects.get(pk=self.ship_id).last_activity)
 
+  def test_post_valid(self):
+    donor_a = Donor(membership_id=self.ship_id, firstname='Taboo')
+    donor_a.save()
+    donor_b = Donor(membership_id=self.ship_id, firstname='Boggle')
+    donor_b.save()
+
+    date = timezone.now() + timedelta(days=5)
+    form_data = {
+      'form-TOTAL_FORMS': u'2',
+      'form-INITIAL_FORMS': u'2',
+      'form-MAX_NUM_FORMS': u'10',
+      'form-0-donor': unicode(donor_a.pk),
+      'form-0-date': '{:%m/%d/%Y}'.format(date),
+      'form-0-description': 'Talk',
+      'form-1-donor': unicode(donor_b.pk),
+      'form-1-date': '{:%m/%d/%Y}'.format(date),
+      'form-1-description': 'Ask'
+    }
+    res = self.client.post(self.url, form_data)
+
+    self.assertEqual(res.content, 'success')
+    for donor in Donor.objects.filter(pk__in=[donor_a.pk, donor_b.pk]):
+      step = Step.objects.get(donor=donor)
+      self.assertEqual(donor.next_step_id, step.pk)
+      self.assertEqual(donor.next_step_date, date.date())
+
+  def test_post_other_members_donor(self):
+    other = Donor.objects.exclude(membership_id=self.ship_id)[0]
+    form_data = {
+      'form-TOTAL_FORMS': u'1',
+      'form-INITIAL_FORMS': u'1',
+      'form-MAX_NUM_FORMS': u'10',
+      'form-0-donor': unicode(other.pk),
+      'form-0-date': '{:%m/%d/%Y}'.format(timezone.now()),
+      'form-0-description': 'Talk'
+    }
+    res = self.client.post(self.url, form_data)
+
+    self.assertEqual(res.status_code, 400)
+    self.assertFalse(Step.objects.filter(donor=other, description='Talk').exists())
+
   def test_post_invalid(self):
     donor_a = Donor(membership_id=self.ship_id, firstname='Taboo')
     donor_a.save()
@@ -588,3 +633,129 @@ class AddMultStep(BaseFundTestCase):
     self.assertTemplateUsed(res, 'fund/forms/add_mult_step.html')
     self.assertFormsetError(res, 'formset', 0, 'description', 'This field is required.')
     self.assertFormsetError(res, 'formset', 1, 'date', 'Please enter a date in mm/dd/yyyy format.')
+
+
+class NextStep(BaseFundTestCase):
+  """ Donor.next_step & next_step_date are kept in sync with its steps """
+
+  def setUp(self):
+    super(NextStep, self).setUp()
+    self.login_as_member('new')
+    donor = Donor(firstname='user', lastname='', membership_id=self.pre_id)
+    donor.save()
+    self.donor_id = donor.pk
+
+  def assert_next_step(self, step):
+    donor = Donor.objects.get(pk=self.donor_id)
+    self.assertEqual(donor.next_step_id, step and step.pk)
+    self.assertEqual(donor.next_step_date, step and step.date)
+
+  def test_create_and_complete(self):
+    self.assert_next_step(None)
+
+    step = Step.objects.create(donor_id=self.donor_id, date='2034-11-13',
+                               description='Talk')
+    step = Step.objects.get(pk=step.pk)
+    self.assert_next_step(step)
+
+    step.completed = timezone.now()
+    step.save()
+    self.assert_next_step(None)
+
+  def test_complete_view(self):
+    step = Step.objects.create(donor_id=self.donor_id, date='2034-11-13',
+                               description='Talk')
+    url = reverse('sjfnw.fund.views.complete_step',
+                  kwargs={'donor_id': self.donor_id, 'step_id': step.pk})
+
+    response = self.client.post(url, {'asked': '', 'response': 2, 'notes': 'Talked'})
+
+    self.assertEqual(response.content, 'success')
+    self.assert_next_step(None)
+    response = self.client.post(
+        reverse('sjfnw.fund.views.add_step', kwargs={'donor_id': self.donor_id}),
+        {'date': '11/20/2034', 'description': 'Ask'})
+    self.assertEqual(response.content, 'success')
+    self.assert_next_step(Step.objects.get(donor_id=self.donor_id, completed__isnull=True))
+
+  def test_edit_date(self):
+    step = Step.objects.create(donor_id=self.donor_id, date='2034-11-13',
+                               description='Talk')
+    step.date = timezone.now().date()
+    step.save()
+
+    self.assert_next_step(step)
+
+  def test_earliest_incomplete(self):
+    later = Step.objects.create(donor_id=self.donor_id, date='2034-11-20',
+                                description='Ask')
+    earlier = Step.objects.create(donor_id=self.donor_id, date='2034-11-13',
+                                  description='Talk')
+    earlier = Step.objects.get(pk=earlier.pk)
+    self.assert_next_step(earlier)
+
+    earlier.delete()
+    self.assert_next_step(Step.objects.get(pk=later.pk))
+
+  def test_delete_donor(self):
+    Step.objects.create(donor_id=self.donor_id, date='2034-11-13', description='Talk')
+
+    Donor.objects.get(pk=self.donor_id).delete()
+
+    self.assertFalse(Step.objects.filter(donor_id=self.donor_id).exists())
+
+  def test_delete_donor_queries(self):
+    """ Next step isn't recomputed for each step of a donor being deleted """
+    other = Donor.objects.create(firstname='Other', membership_id=self.pre_id)
+    for donor_id, count in ((self.donor_id, 1), (other.pk, 3)):
+      Step.objects.bulk_create([Step(donor_id=donor_id, date='2034-11-13', description='Talk')
+                                for _ in range(count)])
+    donor, other = Donor.objects.get(pk=self.donor_id), Donor.objects.get(pk=other.pk)
+
+    with CaptureQueriesContext(connection) as queries:
+      donor.delete()
+    with self.assertNumQueries(len(queries)):
+      other.delete()
+
+  def test_update_next_steps(self):
+    step = Step.objects.create(donor_id=self.donor_id, date='2034-11-13',
+                               description='Talk')
+    Donor.objects.filter(pk=self.donor_id).update(next_step=None, next_step_date=None)
+
+    self.assertEqual(Donor.objects.all().update_next_steps(), 1)
+    self.assert_next_step(Step.objects.get(pk=step.pk))
+    self.assertEqual(Donor.objects.all().update_next_steps(), 0)
+
+  def test_update_next_steps_batched(self):
+    donors = [Donor.objects.create(firstname='Donor{}'.format(i), membership_id=self.pre_id)
+              for i in range(5)]
+    Step.objects.bulk_create([Step(donor=donor, date='2034-11-13', description='Talk')
+                              for donor in donors])
+
+    # steps, donors, then one update per batch
+    with self.assertNumQueries(4):
+      updated = Donor.objects.filter(pk__in=[d.pk for d in donors]).update_next_steps(
+          batch_size=3)
+    self.assertEqual(updated, 5)
+    self.assertFalse(Donor.objects.filter(pk__in=[d.pk for d in donors],
+                                          next_step__isnull=True).exists())
+
+  def test_step_saved_queries(self):
+    step = Step.objects.create(donor_id=self.donor_id, date='2034-11-13',
+                               description='Talk')
+    step = Step.objects.get(pk=step.pk)
+    step.description = 'Talk more'
+
+    # update, next step (steps & donors, unchanged so no update), progress ids
+    with self.assertNumQueries(4):
+      step.save()
+
+  def test_migration(self):
+    step = Step.objects.create(donor_id=self.donor_id, date='2034-11-13',
+                               description='Talk')
+    Donor.objects.update(next_step=None, next_step_date=None)
+
+    migration = import_module('sjfnw.fund.migrations.0009_data_donor_next_step')
+    migration.set_next_steps(apps, None)
+
+    self.assert_next_step(Step.objects.get(pk=step.pk))
@@ -1,8 +1,12 @@
+from datetime import timedelta
 import logging
 
 from django.contrib.auth.models import User
+from django.utils import timezone
 
-from sjfnw.fund import models
+from mock import patch
+
+from sjfnw.fund import models, views
 from sjfnw.fund.views import _create_membership
 from sjfnw.fund.tests.base import BaseFundTestCase
 
@@ -75,3 +79,34 @@ class CreateMembership(BaseFundTestCase):
     self.assertIsNone(error)
     self.assertIsInstance(membership, models.Membership)
     self.assertTrue(membership.approved)
+
+
+@patch.object(views.deferred, 'defer')
+class QueueStoryUpdate(BaseFundTestCase):
+
+  def setUp(self):
+    super(QueueStoryUpdate, self).setUp()
+    self.login_as_member('current')
+    self.now = timezone.now()
+    models.Step.objects.filter(pk=self.step_id).update(completed=self.now)
+
+  def test_coalesced(self, defer):
+    for _ in range(20):
+      views._queue_story_update(self.ship_id, self.now)
+
+    defer.assert_called_once_with(views._update_story, self.ship_id, self.now,
+                                  _countdown=views.STORY_UPDATE_DELAY)
+
+  def test_queue_after_update(self, defer):
+    views._queue_story_update(self.ship_id, self.now)
+    views._update_story(self.ship_id, self.now)
+    views._queue_story_update(self.ship_id, self.now)
+
+    self.assertEqual(defer.call_count, 2)
+    self.assert_count(models.NewsItem.objects.filter(membership_id=self.ship_id), 1)
+
+  def test_separate_days(self, defer):
+    views._queue_story_update(self.ship_id, self.now)
+    views._queue_story_update(self.ship_id, self.now - timedelta(days=1))
+
+    self.assertEqual(defer.call_count, 2)
@@ -21,6 +21,7 @@ urlpatterns = patterns('sjfnw.fund.views',
 
   # forms - contacts
   (r'^add-contacts', 'add_mult'),
+  (r'^import-contacts', 'import_contacts'),
   (r'^(?P<donor_id>\d+)/edit', 'edit_contact'),
   (r'^(?P<donor_id>\d+)/delete', 'delete_contact'),
   (r'^add-estimates', 'add_estimates'),
@@ -1,21 +1,30 @@
-import datetime, logging, os, json
+from itertools import chain
+import logging, os, json, re
 
 from django.conf import settings
 from django.contrib import auth
 from django.contrib.auth.decorators import login_required
 from django.contrib.humanize.templatetags.humanize import intcomma
+from django.core.cache import cache
+from django.core.files.uploadhandler import FileUploadHandler
 from django.core.urlresolvers import reverse
+from django.db import transaction
 from django.forms.formsets import formset_factory
 from django.http import HttpResponse, Http404
 from django.shortcuts import render, redirect
 from django.utils import timezone
 from django.utils.http import is_safe_url
 
-from google.appengine.ext import deferred, ereporter
+from google.appengine.ext import blobstore, deferred, ereporter
+
+import unicodecsv
 
 from sjfnw import constants as c, utils
+from sjfnw.fund.blocks import get_project_blocks
 from sjfnw.fund.decorators import require_member
 from sjfnw.fund import forms, modelforms, models
+from sjfnw.fund.progress import (get_membership_progress, get_project_progress,
+                                 invalidate_progress)
 from sjfnw.grants.models import Organization, ProjectApp
 
 if not settings.DEBUG:
@@ -23,6 +32,11 @@ if not settings.DEBUG:
 
 logger = logging.getLogger('sjfnw')
 
+# seconds to wait before updating a member's news story after a step is completed
+STORY_UPDATE_DELAY = 60 * 2
+# upper bound on a pending update's cache flag, in case the task never runs
+STORY_UPDATE_TIMEOUT = 60 * 30
+
 # ----------------------------------------------------------------------------
 #  MAIN VIEWS
 # ----------------------------------------------------------------------------
@@ -57,7 +71,7 @@ def home(request):
     }))
 
   # check if they have contacts
-  donors = membership.donor_set.prefetch_related('step_set')
+  donors = membership.donor_set.order_by_next_step().prefetch_related('step_set')
   if not donors:
     if not membership.copied_contacts:
       all_donors = models.Donor.objects.filter(membership__member=membership.member)
@@ -85,8 +99,9 @@ def home(request):
     membership.save(skip=True)
 
   # compile steps and progress metrics
-  progress, incomplete_steps = _compile_membership_progress(donors)
-  donors = sorted(donors, key=_get_converted_date)
+  progress = get_membership_progress(
+      membership.pk, lambda: _compile_membership_progress(membership.donor_set.all()))
+  incomplete_steps = _organize_donors(donors)
 
   # suggested steps for step forms
   suggested = membership.giving_project.get_suggested_steps()
@@ -114,82 +129,67 @@ def home(request):
     'notif': notif, 'suggested': suggested, 'load': load, 'loadto': loadto
   })
 
-def _get_converted_date(donor):
-  """ Use future date for donors without next step so they'll get sorted to the end """
-  if hasattr(donor, 'next_step'):
-    return donor.next_step.date
-  return datetime.date(2100, 01, 01)
-
-
 def _compile_membership_progress(donors):
-  """ Go through membership's donors and steps, compiling progress metrics
-    and organizing steps based on completion
+  """ Compile progress metrics for a membership's donors
 
-    Adds summary attribute to donors (and others via donor.organize_steps)
+    Args:
+      donors - Donor queryset; totals are computed in the database
 
     Returns:
-      progress - dict, see progress dict definition below
-      incomplete_steps - list of incomplete Steps for this membership
+      progress - dict, see DonorQuerySet.get_progress, plus contacts_remaining,
+        togo and header for the progress chart
   """
-  progress = {
-    'contacts': len(donors),
-    'contacts_remaining': len(donors),
-    'estimated': 0,
-    'talked': 0,
-    'asked': 0,
-    'promised': 0,
-    'received': 0
-  }
+  progress = donors.get_progress()
+  progress['contacts_remaining'] = progress['contacts'] - progress['talked'] - progress['asked']
 
-  if not donors:
+  if not progress['contacts']:
     logger.error('Membership has no contacts but wasn\'t redirected to add_mult')
-    return progress, []
+    return progress
+
+  # progress chart calculations
+  amount_raised = progress['promised'] + progress['received']
+  progress['togo'] = max(progress['estimated'] - amount_raised, 0)
+  if progress['togo'] > 0:
+    progress['header'] = '${} fundraising goal'.format(intcomma(progress['estimated']))
+  else:
+    progress['header'] = '${} raised'.format(intcomma(amount_raised))
+
+  return progress
 
-  # compile progress metrics and donor summaries
+
+def _organize_donors(donors):
+  """ Add summary attribute to donors (and others via donor.organize_steps)
+    and organize steps based on completion
+
+    Args:
+      donors: donors annotated with totals (see DonorQuerySet.with_totals)
+
+    Returns:
+      incomplete_steps - list of incomplete Steps for this membership, by date
+  """
+  incomplete_steps = []
   for donor in donors:
     donor.summary = ''
 
     if donor.asked:
-      progress['asked'] += 1
       donor.summary = 'Asked. '
-    elif donor.talked:
-      progress['talked'] += 1
-
-    progress['estimated'] += donor.estimated()
 
-    if donor.received() > 0:
-      donor.summary += ' $%s received by SJF.' % intcomma(donor.received())
-      progress['received'] += donor.received()
-      if donor.received() < donor.total_promised():
-        progress['promised'] += donor.total_promised() - donor.received()
+    if donor.received_total > 0:
+      donor.summary += ' $%s received by SJF.' % intcomma(donor.received_total)
     elif donor.promised:
-      donor.summary += ' Total promised $%s.' % intcomma(donor.total_promised())
-      progress['promised'] += donor.total_promised()
+      donor.summary += ' Total promised $%s.' % intcomma(donor.promised_total)
     elif donor.asked:
       if donor.promised == 0:
         donor.summary += ' Declined to donate.'
       else:
         donor.summary += ' Awaiting response.'
 
-  # progress chart calculations
-  if progress['contacts'] > 0:
-    amount_raised = progress['promised'] + progress['received']
-    progress['contacts_remaining'] = progress['contacts'] - progress['talked'] - progress['asked']
-    progress['togo'] = max(progress['estimated'] - amount_raised, 0)
-    if progress['togo'] > 0:
-      progress['header'] = '${} fundraising goal'.format(intcomma(progress['estimated']))
-    else:
-      progress['header'] = '${} raised'.format(intcomma(amount_raised))
-
-  # process steps; compile incompletes
-  incomplete_steps = []
-  for donor in donors:
     donor.organize_steps()
-    if hasattr(donor, 'next_step'):
+    if donor.next_step:
       incomplete_steps.append(donor.next_step)
-  incomplete_steps.sort(key=lambda step: step.date)
 
-  return progress, incomplete_steps
+  incomplete_steps.sort(key=lambda step: step.date)
+  return incomplete_steps
 
 
 @require_member(require_membership=True)
@@ -202,24 +202,7 @@ def project_page(request):
   header = project.title
 
   # project metrics/progress
-  progress = {'contacts': 0, 'talked': 0, 'asked': 0, 'promised': 0, 'received': 0}
-  donors = list(models.Donor.objects.filter(membership__giving_project=project))
-  progress['contacts'] = len(donors)
-  for donor in donors:
-    donor.summary = []
-    if donor.asked:
-      progress['asked'] += 1
-    elif donor.talked:
-      progress['talked'] += 1
-    if donor.received() > 0:
-      progress['received'] += donor.received()
-    elif donor.promised:
-      progress['promised'] += donor.total_promised()
-
-  progress['contacts_remaining'] = progress['contacts'] - progress['talked'] - progress['asked']
-  progress['togo'] = project.fund_goal - progress['promised'] - progress['received']
-  if progress['togo'] < 0:
-    progress['togo'] = 0
+  progress = get_project_progress(project)
 
   # project resources
   resources = (models.ProjectResource.objects.filter(giving_project=project)
@@ -490,15 +473,16 @@ def copy_contacts(request):
       formset = copy_formset(request.POST)
       logger.info('Copy contracts submitted')
       if formset.is_valid():
-        for form in formset.cleaned_data:
-          if form['select']:
-            contact = models.Donor(membership=request.membership,
-                firstname=form['firstname'], lastname=form['lastname'],
-                phone=form['phone'], email=form['email'], notes=form['notes'])
-            contact.save()
-            logger.debug('Contact created')
-        request.membership.copied_contacts = True
-        request.membership.save()
+        contacts = [models.Donor(membership=request.membership,
+                                 firstname=form['firstname'], lastname=form['lastname'],
+                                 phone=form['phone'], email=form['email'],
+                                 notes=form['notes'])
+                    for form in formset.cleaned_data if form['select']]
+        with transaction.atomic():
+          _create_contacts(request.membership, contacts)
+          request.membership.copied_contacts = True
+          request.membership.save()
+        logger.info('%d contacts copied', len(contacts))
         return HttpResponse('success')
       else: # invalid
         logger.warning('Copy formset somehow invalid?! ' + str(request.POST))
@@ -565,16 +549,17 @@ def add_mult(request):
       if formset.has_changed():
         logger.info('AddMult valid formset')
 
-        # get list of existing donors to check for duplicates
-        donors = models.Donor.objects.filter(membership=membership)
-        donors = [unicode(donor) for donor in donors]
+        # names of existing donors to check for duplicates
+        existing = membership.donor_set.name_keys()
         duplicates = []
+        contacts = []
 
         for form in formset.cleaned_data:
           if form: # ignore blank rows
             confirm = form['confirm'] and form['confirm'] == '1'
+            name_key = models.Donor.name_key(form['firstname'], form['lastname'])
 
-            if not confirm and (form['firstname'] + ' ' + form['lastname'] in donors):
+            if not confirm and name_key in existing:
               # this entry is a duplicate that has not yet been confirmed
               initial = {'firstname': form['firstname'],
                          'lastname': form['lastname'],
@@ -585,15 +570,15 @@ def add_mult(request):
               duplicates.append(initial)
 
             else: # not a duplicate
+              contact = models.Donor(membership=membership,
+                  firstname=form['firstname'], lastname=form['lastname'])
               if est:
-                contact = models.Donor(membership=membership,
-                    firstname=form['firstname'], lastname=form['lastname'],
-                    amount=form['amount'], likelihood=form['likelihood'])
-              else:
-                contact = models.Donor(membership=membership,
-                    firstname=form['firstname'], lastname=form['lastname'])
-              contact.save()
-              logger.info('contact created')
+                contact.amount = form['amount']
+                contact.likelihood = form['likelihood']
+              contacts.append(contact)
+
+        _create_contacts(membership, contacts)
+        logger.info('%d contacts created', len(contacts))
 
         if duplicates:
           logger.info('Showing confirmation page for duplicates: ' + str(duplicates))
@@ -630,6 +615,77 @@ def add_mult(request):
     })
 
 
+@require_member(require_membership=True)
+def import_contacts(request):
+  """ Add contacts from an uploaded CSV or tab-separated file
+
+    The form posts to a blobstore upload url, so the file is stored in the
+    blobstore and streamed from there rather than held in memory. It's deleted
+    once it has been read.
+
+    Rows are validated like add_mult rows and saved in batches as the file is
+    read. If any row is invalid nothing is saved and the errors are shown.
+    Rows with the same name as an existing contact (or an earlier row) are not
+    saved; they're shown in the add_mult form to be confirmed, as in add_mult.
+  """
+  membership = request.membership
+  est = membership.giving_project.require_estimates()
+  row_errors, error_count, upload_error = [], 0, None
+
+  if request.method == 'POST' and _import_too_large(request):
+    # posted directly rather than via the blobstore; don't read it
+    logger.warning('Import - %s byte request rejected', request.META.get('CONTENT_LENGTH'))
+    form, upload_error = forms.ImportContacts(), IMPORT_TOO_LARGE
+  elif request.method == 'POST':
+    # don't remove; BlobstoreFileUploadHandler reads the blob key from the body
+    logger.debug([request.body])
+    request.upload_handlers.append(_RejectedUploadHandler(request))
+    form = forms.ImportContacts(request.POST, request.FILES)
+    if getattr(request, 'upload_rejected', False):
+      logger.warning('Import - upload was not stored in the blobstore')
+      form, upload_error = forms.ImportContacts(), IMPORT_REJECTED
+    elif form.is_valid():
+      membership.last_activity = timezone.now()
+      membership.save()
+      contacts_file = form.cleaned_data['contacts_file']
+      try:
+        imported, duplicates, row_errors, error_count = _import_contacts(
+            membership, contacts_file, est)
+      except ValueError as err:
+        form.add_error('contacts_file', unicode(err))
+      else:
+        if duplicates:
+          logger.info('Import - %d contacts saved, %d duplicates', imported, len(duplicates))
+          contact_formset = formset_factory(forms.MassDonor if est else forms.MassDonorPre)
+          steps, news, grants = _get_block_content(membership)
+          return render(request, 'fund/forms/add_contacts.html', {
+            '1active': 'true', 'header': membership.giving_project.title,
+            'news': news, 'grants': grants, 'steps': steps,
+            'formset': contact_formset(initial=duplicates),
+            'post_url': reverse(add_mult),
+            'empty_error': (u'<ul class="errorlist"><li>{} contacts were imported. The '
+              'contacts below have the same name as contacts you have already entered. '
+              'Press save to confirm that you want to add them.</li></ul>'.format(imported))
+          })
+        elif not error_count:
+          logger.info('Import - %d contacts saved', imported)
+          return redirect(home)
+      finally:
+        if hasattr(contacts_file, 'blobstore_info'):
+          blobstore.delete(contacts_file.blobstore_info.key())
+  else:
+    form = forms.ImportContacts()
+
+  steps, news, grants = _get_block_content(membership)
+  return render(request, 'fund/forms/import_contacts.html', {
+    '1active': 'true', 'header': membership.giving_project.title,
+    'news': news, 'grants': grants, 'steps': steps, 'form': form, 'est': est,
+    'row_errors': row_errors, 'more_errors': error_count - len(row_errors),
+    'upload_error': upload_error,
+    'upload_url': blobstore.create_upload_url(reverse(import_contacts))
+  })
+
+
 @require_member(require_membership=True)
 def add_estimates(request):
   membership = request.membership
@@ -639,7 +695,7 @@ def add_estimates(request):
 
   # get all donors without estimates
   for donor in membership.donor_set.filter(amount__isnull=True):
-    initial_form_data.append({'donor': donor})
+    initial_form_data.append({'donor': donor.pk})
     donor_names.append(unicode(donor))
 
   # create formset
@@ -652,13 +708,15 @@ def add_estimates(request):
     logger.debug('Adding estimates - posted: ' + str(request.POST))
 
     if formset.is_valid():
-      logger.debug('Adding estimates - is_valid passed, cycling through forms')
-      for form in formset.cleaned_data:
-        if form:
-          donor = form['donor']
-          donor.amount = form['amount']
-          donor.likelihood = form['likelihood']
-          donor.save()
+      estimates = {form['donor']: (form['amount'], form['likelihood'])
+                   for form in formset.cleaned_data if form}
+      if not _own_donors(membership, estimates):
+        return HttpResponse(status=400, content='Contact not found')
+      with transaction.atomic():
+        membership.donor_set.set_estimates(estimates)
+        # set_estimates skips signals
+        invalidate_progress(membership.pk, membership.giving_project_id)
+      logger.info('Adding estimates - %d donors updated', len(estimates))
       return HttpResponse("success")
 
     else: # invalid form
@@ -761,7 +819,7 @@ def add_step(request, donor_id):
     logger.error('Single step - tried to add step to nonexistent donor.')
     raise Http404('Donor not found')
 
-  if donor.get_next_step():
+  if donor.next_step_id:
     logger.error('Trying to add step, donor has an incomplete')
     return HttpResponse(status=400, content='Donor already has a next step')
 
@@ -792,19 +850,16 @@ def add_step(request, donor_id):
 
 @require_member(require_membership=True)
 def add_mult_step(request):
-  initial_form_data = [] # list of dicts for form initial
-  donor_list = [] # list of donors for zipping to formset
-  size = 0
   membership = request.membership
   suggested = membership.giving_project.get_suggested_steps()
 
-  for donor in membership.donor_set.order_by('-added'):
-    if donor.received() == 0 and donor.promised is None and donor.get_next_step() is None:
-      initial_form_data.append({'donor': donor})
-      donor_list.append(donor)
-      size = size + 1
-    if size > 9:
-      break
+  # up to 10 most recently added donors with no next step, promise or gift
+  donor_list = list(membership.donor_set # for zipping to formset
+      .filter(next_step__isnull=True, promised__isnull=True)
+      .exclude(models.DonorQuerySet.has_received())
+      .order_by('-added')[:10])
+  initial_form_data = [{'donor': donor.pk} for donor in donor_list]
+  size = len(donor_list)
 
   step_formset = formset_factory(forms.MassStep, extra=0)
 
@@ -814,13 +869,18 @@ def add_mult_step(request):
     formset = step_formset(request.POST)
     logger.debug('Multiple steps - posted: ' + str(request.POST))
     if formset.is_valid():
-      logger.debug('Multiple steps - is_valid passed, cycling through forms')
-      for form in formset.cleaned_data:
-        if form:
-          step = models.Step(donor=form['donor'], date=form['date'],
-                             description=form['description'])
-          step.save()
-          logger.info('Multiple steps - step created')
+      steps = [models.Step(donor_id=form['donor'], date=form['date'],
+                           description=form['description'])
+               for form in formset.cleaned_data if form]
+      if not _own_donors(membership, [step.donor_id for step in steps]):
+        return HttpResponse(status=400, content='Contact not found')
+      with transaction.atomic():
+        models.Step.objects.bulk_create(steps)
+        # bulk_create skips the signals that maintain these
+        membership.donor_set.filter(
+            pk__in=[step.donor_id for step in steps]).update_next_steps()
+        invalidate_progress(membership.pk, membership.giving_project_id)
+      logger.info('Multiple steps - %d steps created', len(steps))
       return HttpResponse("success")
     else:
       logger.info('Multiple steps invalid')
@@ -953,14 +1013,14 @@ def complete_step(request, donor_id, step_id):
             donor.match_expected = match_expected
             donor.match_company = match_company
 
-      # save donor & completed step
-      step.save()
+      # save donor & completed step. donor first: saving the step updates the
+      # donor's next step, which this instance doesn't have
       donor.save()
+      step.save()
 
       # call story creator/updater
       if os.getenv('SERVER_SOFTWARE', '').startswith('Google App Engine'):
-        deferred.defer(membership.update_story, timezone.now())
-        logger.info('Calling update story')
+        _queue_story_update(membership.pk, step.completed)
 
       # process next step input
       next_step = form.cleaned_data['next_step']
@@ -1005,6 +1065,8 @@ def complete_step(request, donor_id, step_id):
 def _get_block_content(membership, get_steps=True):
   """ Provide upper block content for the 3 main views
 
+  News & grants are cached per giving project; steps are always queried.
+
   Args:
     membership: current Membership
     get_steps: whether to include list of upcoming steps
@@ -1024,23 +1086,211 @@ def _get_block_content(membership, get_steps=True):
         .select_related('donor')
         .order_by('date')[:2])
 
-  # project news
+  news, gp_apps = get_project_blocks(
+      membership.giving_project_id,
+      lambda: _compile_project_blocks(membership.giving_project))
+
+  return steps, news, gp_apps
+
+def _compile_project_blocks(project):
+  """ Get news & grants lists for _get_block_content. Same for all members of
+    the project, so they are cached; see blocks.py
+
+  Returns: Tuple:
+    news: list of recent news items, sorted by date descending
+    gp_apps: list of ProjectApps ordered by org name
+  """
   news = (models.NewsItem.objects
-      .filter(membership__giving_project=membership.giving_project)
+      .filter(membership__giving_project=project)
       .order_by('-date')[:25])
 
-  # grants
   gp_apps = (ProjectApp.objects
-      .filter(giving_project=membership.giving_project)
+      .filter(giving_project=project)
       .exclude(application__pre_screening_status=45) # subcommittee screened out
       .exclude(screening_status=130) # closed
       .select_related('giving_project', 'application__organization')
       .order_by('application__organization__name'))
-  if membership.giving_project.site_visits == 1:
+  if project.site_visits == 1:
     logger.info('Filtering grants for site visits')
     gp_apps = gp_apps.filter(screening_status__gte=70)
 
-  return steps, news, gp_apps
+  return list(news), list(gp_apps)
+
+def _create_contacts(membership, contacts):
+  """ Save new Donors for membership with one bulk insert (in a transaction)
+
+    bulk_create doesn't send signals, so progress is invalidated here.
+  """
+  if contacts:
+    models.Donor.objects.bulk_create(contacts)
+    invalidate_progress(membership.pk, membership.giving_project_id)
+
+# normalized column headings accepted by import_contacts -> form field names
+IMPORT_COLUMNS = {
+  'firstname': 'firstname', 'first': 'firstname',
+  'lastname': 'lastname', 'last': 'lastname',
+  'amount': 'amount', 'likelihood': 'likelihood'
+}
+IMPORT_BATCH_SIZE = 100 # contacts per bulk insert
+IMPORT_MAX_ERRORS = 20 # row errors to display
+IMPORT_TOO_LARGE = 'The file was too large to upload. Please try again from this page.'
+IMPORT_REJECTED = 'The file could not be uploaded. Please try again from this page.'
+
+def _import_too_large(request):
+  """ Whether an import request is too large to have come from the blobstore
+
+    Requests forwarded by the blobstore only contain the blob key, so a larger
+    one has the file itself and would have to be read into memory.
+  """
+  try:
+    length = int(request.META.get('CONTENT_LENGTH') or 0)
+  except ValueError:
+    return True
+  return length > settings.FILE_UPLOAD_MAX_MEMORY_SIZE
+
+class _RejectedUploadHandler(FileUploadHandler):
+  """ Last upload handler for import_contacts
+
+    Only reached if the blobstore handler didn't take the file, i.e. it was
+    not posted through a blobstore upload url. Drops the data and sets
+    request.upload_rejected so the view can show an error.
+  """
+
+  def new_file(self, *args, **kwargs):
+    super(_RejectedUploadHandler, self).new_file(*args, **kwargs)
+    self.request.upload_rejected = True
+
+  def receive_data_chunk(self, raw_data, start):
+    return None
+
+  def file_complete(self, file_size):
+    return None
+
+def _read_contacts_file(contacts_file, est):
+  """ Read an uploaded contacts file line by line
+
+    Args:
+      contacts_file: UploadedFile, comma or tab separated, with a header row
+      est: whether amount & likelihood columns are required
+
+    Yields:
+      (line number, dict of form field name -> value) for each non-blank row
+
+    Raises:
+      ValueError if the file is empty or missing required columns
+  """
+  lines = iter(contacts_file)
+  header = next(lines, None)
+  if header is None:
+    raise ValueError('The file is empty.')
+  delimiter = '\t' if '\t' in header else ','
+  reader = unicodecsv.reader(chain([header], lines), delimiter=delimiter,
+                             encoding='utf-8-sig')
+
+  columns = [IMPORT_COLUMNS.get(re.sub(r'[^a-z]', '', heading.lower()))
+             for heading in next(reader)]
+  required = ['firstname', 'amount', 'likelihood'] if est else ['firstname']
+  missing = [name for name in required if name not in columns]
+  if missing:
+    raise ValueError('Missing column(s): {}. See instructions for column names.'.format(
+        ', '.join(missing)))
+
+  for row in reader:
+    data = {name: value.strip() for name, value in zip(columns, row) if name}
+    if any(data.values()):
+      yield reader.line_num, data
+
+def _import_contacts(membership, contacts_file, est):
+  """ Validate and save contacts from a file; see import_contacts
+
+    Returns: Tuple:
+      imported: number of contacts saved
+      duplicates: list of initial data for the add_mult form
+      row_errors: (line number, form errors) of the first IMPORT_MAX_ERRORS
+        invalid rows
+      error_count: total number of invalid rows
+  """
+  form_class = forms.MassDonor if est else forms.MassDonorPre
+  names = membership.donor_set.name_keys()
+  imported, duplicates, row_errors, error_count = 0, [], [], 0
+  contacts = []
+
+  with transaction.atomic():
+    for line_num, data in _read_contacts_file(contacts_file, est):
+      row_form = form_class(data)
+      if not row_form.is_valid():
+        error_count += 1
+        if len(row_errors) < IMPORT_MAX_ERRORS:
+          row_errors.append((line_num, row_form.errors))
+        continue
+      if error_count: # won't be saved; just checking the rest of the file
+        continue
+
+      data = row_form.cleaned_data
+      name_key = models.Donor.name_key(data['firstname'], data['lastname'])
+      if name_key in names:
+        initial = {'firstname': data['firstname'], 'lastname': data['lastname'],
+                   'confirm': u'1'}
+        if est:
+          initial['amount'] = data['amount']
+          initial['likelihood'] = data['likelihood']
+        duplicates.append(initial)
+        continue
+      names.add(name_key)
+
+      contact = models.Donor(membership=membership, firstname=data['firstname'],
+                             lastname=data['lastname'])
+      if est:
+        contact.amount = data['amount']
+        contact.likelihood = data['likelihood']
+      contacts.append(contact)
+      if len(contacts) == IMPORT_BATCH_SIZE:
+        _create_contacts(membership, contacts)
+        imported += len(contacts)
+        contacts = []
+
+    if error_count:
+      transaction.set_rollback(True)
+      return 0, [], row_errors, error_count
+
+    _create_contacts(membership, contacts)
+    imported += len(contacts)
+
+  return imported, duplicates, row_errors, error_count
+
+def _own_donors(membership, donor_ids):
+  """ Check that all the given donor pks belong to membership """
+  donor_ids = set(donor_ids)
+  if not donor_ids:
+    return True
+  missing = donor_ids - set(membership.donor_set.filter(pk__in=donor_ids)
+                                                .values_list('pk', flat=True))
+  if missing:
+    logger.warning('Unknown donor ids submitted by membership %d: %s',
+                   membership.pk, list(missing))
+  return not missing
+
+def _story_update_key(membership_id, timestamp):
+  return 'fund-story-update-{}-{:%Y-%m-%d}'.format(membership_id, timestamp)
+
+def _queue_story_update(membership_id, timestamp):
+  """ Schedule a news story update for the day of timestamp, unless one is
+    already pending. The update covers all steps completed that day, so steps
+    completed in one sitting share a single update. """
+  if cache.add(_story_update_key(membership_id, timestamp), True, STORY_UPDATE_TIMEOUT):
+    deferred.defer(_update_story, membership_id, timestamp, _countdown=STORY_UPDATE_DELAY)
+    logger.info('Story update queued for membership %d', membership_id)
+
+def _update_story(membership_id, timestamp):
+  """ Deferred task for _queue_story_update """
+  # clear first so steps completed while this runs queue another update
+  cache.delete(_story_update_key(membership_id, timestamp))
+  try:
+    membership = models.Membership.objects.select_related('member').get(pk=membership_id)
+  except models.Membership.DoesNotExist:
+    logger.warning('Membership %d deleted before story update', membership_id)
+    return
+  membership.update_story(timestamp)
 
 def _create_membership(member, giving_project, notif=''):
   error = None
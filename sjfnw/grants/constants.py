@@ -83,3 +83,6 @@ NARRATIVE_WORD_LIMITS = {
   'cycle_question': 750,
   'two_year_question': 300
 }
+
+# number of rows per page when browsing reports
+REPORT_PAGE_SIZE = 500
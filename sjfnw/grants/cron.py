@@ -1,7 +1,7 @@
 from datetime import timedelta
 import logging
 
-from django.db.models import Q
+from django.db.models import Count, F, Q
 from django.http import HttpResponse
 from django.utils import timezone
 
@@ -55,13 +55,10 @@ def auto_create_cycles(request):
   if len(created) > 0:
     logger.info('auto_create_cycles created %d new cycles', len(created))
 
-    utils.send_email(
-      subject='Grant cycles created',
-      sender=c.GRANT_EMAIL,
-      to=['aisapatino@gmail.com'],
-      template='grants/emails/auto_create_cycles.html',
-      context={'cycles': created}
-    )
+    batch = utils.EmailBatch('Grant cycles created', c.GRANT_EMAIL,
+                             'grants/emails/auto_create_cycles.html')
+    batch.add(['aisapatino@gmail.com'], context={'cycles': created})
+    batch.send()
     return HttpResponse(status=201)
   else:
     logger.info('auto_create_cycles did nothing; new cycles already existed')
@@ -70,67 +67,90 @@ def auto_create_cycles(request):
 
 def draft_app_warning(request):
   """ Warn orgs of impending draft freezes
-      NOTE: must run exactly once a day
-      Gives 7 day warning if created 7+ days before close, otherwise 3 day warning """
+      NOTE: must run exactly once a day """
+  stats = utils.run_stages([('draft_app_warning', draft_warning_stage)], None)
+  return HttpResponse('', status=utils.stages_status(stats))
+
+def draft_warning_stage(_):
+  """ Build draft warning emails. See utils.run_stages
+      Gives 7 day warning if created 7+ days before close, otherwise 3 day warning
+
+      Windows are applied in the query, so only drafts due a warning are fetched """
 
-  drafts = DraftGrantApplication.objects.all()
+  now = timezone.now()
   eight_days = timedelta(days=8)
+  # created more than 8 days before close, cycle closes in 7-8 days
+  long_warning = Q(created__lt=F('grant_cycle__close') - eight_days,
+                   grant_cycle__close__gt=now + timedelta(days=7),
+                   grant_cycle__close__lt=now + eight_days)
+  # created less than 8 days before close, cycle closes in 2-3 days
+  short_warning = Q(created__gt=F('grant_cycle__close') - eight_days,
+                    grant_cycle__close__gte=now + timedelta(days=2),
+                    grant_cycle__close__lt=now + timedelta(days=3))
+
+  drafts = (DraftGrantApplication.objects
+      .filter(long_warning | short_warning)
+      .select_related('grant_cycle', 'organization__user'))
+
+  batch = utils.EmailBatch('Grant cycle closing soon', c.GRANT_EMAIL,
+                           'grants/email_draft_warning.html')
 
   for draft in drafts:
-    time_left = draft.grant_cycle.close - timezone.now()
-    created_delta = draft.grant_cycle.close - draft.created
-    if ((created_delta > eight_days and eight_days > time_left > timedelta(days=7)) or
-        (created_delta < eight_days and timedelta(days=3) > time_left >= timedelta(days=2))):
-      to_email = draft.organization.get_email()
-
-      if not to_email:
-        logger.warn('Unable to send draft reminder; org is not registered %d', draft.organization.pk)
-        continue
-
-      utils.send_email(
-        subject='Grant cycle closing soon',
-        sender=c.GRANT_EMAIL,
-        to=[to_email],
-        template='grants/email_draft_warning.html',
-        context={'org': draft.organization, 'cycle': draft.grant_cycle}
-      )
-      logger.info('Email sent to %s regarding draft application soon to expire', to_email)
-  return HttpResponse('')
+    to_email = draft.organization.get_email()
+
+    if not to_email:
+      logger.warn('Unable to send draft reminder; org is not registered %d', draft.organization.pk)
+      continue
+
+    batch.add([to_email], context={'org': draft.organization, 'cycle': draft.grant_cycle})
+    logger.info('Emailing %s regarding draft application soon to expire', to_email)
+
+  return batch.messages, None
 
 
 def yer_reminder_email(request):
   """ Remind orgs of upcoming year end reports that are due
-      NOTE: Must run exactly once a day. ONLY SUPPORTS UP TO 2-YEAR GRANTS
+      NOTE: Must run exactly once a day """
+  stats = utils.run_stages([('yer_reminder_email', yer_reminder_stage)], None)
+  return HttpResponse('success', status=utils.stages_status(stats))
+
+def yer_reminder_stage(_):
+  """ Build year end report reminder emails. See utils.run_stages
       Sends reminder emails at 1 month and 1 week """
 
   today = timezone.now().date()
 
-  # get awards due in 7 or 30 days
-  year_ago = today.replace(year=today.year - 1)
-  reminder_deltas = [timedelta(days=7), timedelta(days=30)]
-  award_dates = []
-  for delta in reminder_deltas:
-    award_dates.append(today + delta)
-    award_dates.append((today + delta).replace(year=today.year - 1))
+  # reports due in 7 or 30 days
+  reminder_dates = [today + timedelta(days=7), today + timedelta(days=30)]
+
+  # year end reports are due yearly on the anniversary of first_yer_due. this
+  # matches any year; next_yer_due limits it to the grant's length (1 or 2 years)
+  anniversary = Q()
+  for date in reminder_dates:
+    anniversary |= Q(first_yer_due__month=date.month, first_yer_due__day=date.day,
+                     first_yer_due__lte=date)
+
+  awards = (GivingProjectGrant.objects.filter(anniversary)
+      .annotate(yer_count=Count('yearendreport'))
+      .select_related('projectapp__application__organization__user',
+                      'projectapp__application__grant_cycle',
+                      'projectapp__giving_project'))
 
-  awards = GivingProjectGrant.objects.filter(first_yer_due__in=award_dates)
+  batch = utils.EmailBatch('Year end report', c.GRANT_EMAIL, 'grants/email_yer_due.html',
+                           shared_context={'base_url': c.APP_BASE_URL})
 
   for award in awards:
-    if award.yearendreport_set.count() < award.grant_length():
+    due_date = award.next_yer_due(completed=award.yer_count)
+    if due_date in reminder_dates:
       app = award.projectapp.application
 
       to = app.organization.get_email() or app.email_address
-      utils.send_email(
-        subject='Year end report',
-        sender=c.GRANT_EMAIL,
-        to=[to],
-        template='grants/email_yer_due.html',
-        context={
-          'award': award,
-          'app': app,
-          'gp': award.projectapp.giving_project,
-          'base_url': c.APP_BASE_URL
-        }
-      )
-      logger.info('YER reminder email sent to %s for award %d', to, award.pk)
-  return HttpResponse('success')
+      batch.add([to], context={
+        'award': award,
+        'app': app,
+        'gp': award.projectapp.giving_project,
+        'due_date': due_date
+      })
+      logger.info('Emailing YER reminder to %s for award %d', to, award.pk)
+
+  return batch.messages, None
@@ -5,9 +5,12 @@ from django.contrib.auth.models import User
 from django.core.exceptions import ValidationError
 from django.core.validators import BaseValidator, MinValueValidator
 from django.db import models
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
 from django.forms.models import model_to_dict
 from django.utils import timezone
 
+from sjfnw.fund.blocks import invalidate_project_blocks
 from sjfnw.fund.models import GivingProject
 from sjfnw.grants import constants as gc, utils
 
@@ -718,9 +721,14 @@ class GivingProjectGrant(models.Model):
     else:
       return None
 
-  def yers_due(self):
-    today = timezone.now().date()
-    completed = self.yearendreport_set.count()
+  def yers_due(self, completed=None):
+    """ Returns list of due dates of year-end reports that have not been submitted
+
+      Args:
+        completed: number of submitted year-end reports, if already known
+    """
+    if completed is None:
+      completed = self.yearendreport_set.count()
     yers_due = []
     # these won't be done out of order as are forced to do in order
     for x in range(self.grant_length()):
@@ -728,11 +736,12 @@ class GivingProjectGrant(models.Model):
         yers_due.append(self.first_yer_due.replace(year=self.first_yer_due.year + x))
     return yers_due
 
-  def next_yer_due(self):
+  def next_yer_due(self, completed=None):
     """ Year-end reports are due n year(s) after first_yer_due
       Returns datetime.date or None if all YER have been submitted for this grant
+      See yers_due for args
     """
-    due = self.yers_due()
+    due = self.yers_due(completed=completed)
     if len(due) > 0:
       return due[0]
     else:
@@ -898,3 +907,19 @@ class YERDraft(models.Model):
 
   def is_overdue(self):
     return self.award.next_yer_due() < timezone.now().date()
+
+
+# Giving project members see a cached list of the project's grants
+# (see fund/blocks.py). Raw saves are from loading fixtures
+
+@receiver([post_save, post_delete], sender=ProjectApp)
+def project_app_changed(sender, instance, raw=False, **kwargs):
+  if not raw:
+    invalidate_project_blocks(instance.giving_project_id)
+
+@receiver(post_save, sender=GrantApplication)
+def app_changed(sender, instance, raw=False, **kwargs):
+  # pre_screening_status affects whether it is listed
+  if not raw:
+    for project_id in instance.projectapp_set.values_list('giving_project_id', flat=True):
+      invalidate_project_blocks(project_id)
@@ -0,0 +1,538 @@
+""" Grant reports
+
+  Each report is a registry of columns. A column knows how to get its value
+  from a row object and which fields/relations that needs, so a report only
+  loads what its selected columns use and each row is built by calling a
+  precompiled list of extractors.
+"""
+from collections import namedtuple
+from datetime import datetime
+import logging
+from operator import attrgetter
+
+from django.db.models import Count
+from django.utils import timezone
+
+from sjfnw import utils
+from sjfnw.grants import constants as gc, models
+from sjfnw.grants.utils import local_date_str
+
+logger = logging.getLogger('sjfnw')
+
+PRE_SCREENING_DISPLAY = dict(gc.PRE_SCREENING)
+SCREENING_DISPLAY = dict(gc.SCREENING)
+
+# -----------------------------------------------------------------------------
+#  Columns
+# -----------------------------------------------------------------------------
+
+def display_name(name):
+  """ Format a field name for use as a column header """
+  return name.capitalize().replace('_', ' ')
+
+
+class Column(object):
+  """ A single report column
+
+    Args:
+      name: key used to select the column
+      path: dotted attribute path from the row object to the value
+        (e.g. 'organization.name') or a function that takes the row object.
+        Defaults to name
+      header: column header. Defaults to formatted name
+      formatter: function to apply to the value
+      load: field lookups needed, for only(). Defaults to the path
+      select: relations to select_related. Defaults to relations in the path
+      prefetch: relations to prefetch_related
+      annotate: dict of annotations the column reads
+  """
+
+  def __init__(self, name, path=None, header=None, formatter=None, load=None,
+               select=None, prefetch=(), annotate=None):
+    self.name = name
+    self.header = header or display_name(name)
+    self.prefetch = prefetch
+    self.annotate = annotate or {}
+
+    path = path or name
+    if callable(path):
+      get_value = path
+      self.load = load or ()
+      self.select = select or ()
+    else:
+      get_value = attrgetter(path)
+      parts = path.split('.')
+      self.load = ('__'.join(parts),) if load is None else load
+      if select is None:
+        select = ('__'.join(parts[:-1]),) if len(parts) > 1 else ()
+      self.select = select
+
+    if formatter:
+      self.extract = lambda obj: formatter(get_value(obj))
+    else:
+      self.extract = get_value
+
+
+def registry(*columns):
+  """ Returns dict of columns by name """
+  return {column.name: column for column in columns}
+
+
+def org_columns(path=None, header_prefix=''):
+  """ Columns for organization profile fields
+
+    Args:
+      path: dotted path from the report's row object to the organization,
+        or None if rows are organizations
+      header_prefix: prepended to each column header
+  """
+  columns = []
+  for field in models.Organization.get_profile_fields():
+    columns.append(Column(field, path=path + '.' + field if path else field,
+                          header=header_prefix + display_name(field)))
+  return registry(*columns)
+
+
+CompiledReport = namedtuple('CompiledReport',
+    ['headers', 'extractors', 'load', 'select', 'prefetch', 'annotate'])
+
+def compile_columns(columns):
+  """ Combine a list of columns into what's needed to run the report """
+  load, select, prefetch, annotate = set(), set(), set(), {}
+  for column in columns:
+    load.update(column.load)
+    select.update(column.select)
+    prefetch.update(column.prefetch)
+    annotate.update(column.annotate)
+  return CompiledReport(
+    headers=[column.header for column in columns],
+    extractors=tuple(column.extract for column in columns),
+    load=sorted(load), select=sorted(select),
+    prefetch=sorted(prefetch), annotate=annotate
+  )
+
+class ReportRows(object):
+  """ Rows of a report, built lazily from a queryset
+
+    Iterating fetches every row. Slicing limits the queryset, so only that
+    page is fetched (LIMIT/OFFSET), e.g. rows[20:40]
+  """
+
+  def __init__(self, queryset, extractors, prefetch):
+    self.queryset = queryset
+    self.extractors = extractors
+    self.prefetch = prefetch
+
+  def __getitem__(self, key):
+    if not isinstance(key, slice):
+      raise TypeError('ReportRows only supports slicing')
+    return ReportRows(self.queryset[key], self.extractors, self.prefetch)
+
+  def __iter__(self):
+    if self.prefetch:
+      # iterator() would skip the prefetches
+      objects = utils.iterate_in_chunks(self.queryset)
+    else:
+      objects = self.queryset.iterator()
+    for obj in objects:
+      yield [extract(obj) for extract in self.extractors]
+
+def run_report(queryset, columns):
+  """ Apply the columns' requirements to a queryset and build rows lazily
+
+    Args:
+      queryset: filtered queryset of row objects, with a stable ordering
+      columns: list of Column
+
+    Returns:
+      headers: list of column headers
+      rows: ReportRows; lists of values, one per row object
+  """
+  report = compile_columns(columns)
+
+  if report.select:
+    queryset = queryset.select_related(*report.select)
+  if report.annotate:
+    queryset = queryset.annotate(**report.annotate)
+  if report.load:
+    queryset = queryset.only(*report.load)
+  if report.prefetch:
+    queryset = queryset.prefetch_related(*report.prefetch)
+
+  return report.headers, ReportRows(queryset, report.extractors, bool(report.prefetch))
+
+# -----------------------------------------------------------------------------
+#  Application report
+# -----------------------------------------------------------------------------
+
+def _pre_screening_display(val):
+  return PRE_SCREENING_DISPLAY[val] if val else val
+
+def _app_gps(app):
+  return ', '.join(papp.giving_project.title for papp in app.projectapp_set.all())
+
+def _app_gp_screening(app):
+  statuses = []
+  for papp in app.projectapp_set.all():
+    if papp.screening_status:
+      statuses.append(u'{} ({}) '.format(SCREENING_DISPLAY[papp.screening_status],
+                                         papp.giving_project.title))
+    else:
+      statuses.append(u'{} (none) '.format(papp.giving_project.title))
+  return ', '.join(statuses)
+
+def _app_awards(app):
+  awards = []
+  for papp in app.projectapp_set.all():
+    try:
+      award = papp.givingprojectgrant
+    except models.GivingProjectGrant.DoesNotExist:
+      continue
+    awards.append(u'{} {} '.format(award.total_amount(), papp.giving_project.title))
+  return ', '.join(awards)
+
+APP_COLUMNS = registry(*[Column(f.name) for f in models.GrantApplication._meta.fields])
+APP_COLUMNS.update(registry(
+  Column('submission_time', formatter=local_date_str),
+  Column('organization', path='organization.name'),
+  Column('grant_cycle', path='grant_cycle.title'),
+  Column('pre_screening_status', formatter=_pre_screening_display),
+  Column('gps', path=_app_gps, header='Assigned GPs',
+         prefetch=('projectapp_set__giving_project',)),
+  Column('gp_screening', path=_app_gp_screening, header='GP screening status',
+         prefetch=('projectapp_set__giving_project',)),
+  Column('awards', path=_app_awards, header='Awarded',
+         prefetch=('projectapp_set__giving_project', 'projectapp_set__givingprojectgrant'))
+))
+
+def get_min_max_year(options):
+  current_tz = timezone.get_current_timezone()
+  min_year = datetime.strptime(options['year_min'], '%Y') # will default to beginning of year
+  min_year = timezone.make_aware(min_year, current_tz)
+  max_year = datetime.strptime(options['year_max'] + '-12-31 23:59:59', '%Y-%m-%d %H:%M:%S')
+  max_year = timezone.make_aware(max_year, current_tz)
+  return min_year, max_year
+
+def get_app_results(options):
+  """ Fetches application report results
+
+  Arguments:
+    options - cleaned_data from a request.POST-filled instance of AppReportForm
+
+  Returns:
+    A list of display-formatted field names. Example:
+      ['Submitted', 'Organization', 'Grant cycle']
+
+    ReportRows: rows of application & related info. Example:
+      (
+        ['2011-04-20 06:18:36+0:00', 'Justice League', 'LGBTQ Grant Cycle'],
+        ['2013-10-23 09:08:56+0:00', 'ACLU of Idaho', 'General Grant Cycle'],
+      )
+  """
+  logger.info('Get app results')
+
+  apps = models.GrantApplication.objects.order_by('-submission_time', '-pk')
+
+  # filters
+  min_year, max_year = get_min_max_year(options)
+  apps = apps.filter(submission_time__gte=min_year, submission_time__lte=max_year)
+
+  if options.get('organization_name'):
+    apps = apps.filter(organization__name__contains=options['organization_name'])
+  if options.get('city'):
+    apps = apps.filter(city=options['city'])
+  if options.get('state'):
+    apps = apps.filter(state__in=options['state'])
+  if options.get('has_fiscal_sponsor'):
+    apps = apps.exclude(fiscal_org='')
+
+  if options.get('pre_screening_status'):
+    apps = apps.filter(pre_screening_status__in=options.get('pre_screening_status'))
+  if options.get('screening_status'):
+    apps = apps.filter(projectapp__screening_status__in=options.get('screening_status'))
+  if options.get('poc_bonus'):
+    apps = apps.filter(scoring_bonus_poc=True)
+  if options.get('geo_bonus'):
+    apps = apps.filter(scoring_bonus_geo=True)
+  if options.get('grant_cycle'):
+    apps = apps.filter(grant_cycle__title__in=options.get('grant_cycle'))
+  if options.get('giving_projects'):
+    apps = apps.filter(giving_projects__title__in=options.get('giving_projects'))
+
+  # fields
+  fields = (['submission_time', 'organization', 'grant_cycle'] +
+            options['report_basics'] + options['report_contact'] +
+            options['report_org'] + options['report_proposal'] +
+            options['report_budget'])
+  if options['report_fiscal']:
+    fields += models.GrantApplication.fields_starting_with('fiscal')
+    fields.remove('fiscal_letter')
+  # TODO re-implement references reporting
+  if options['report_bonuses']:
+    fields.append('scoring_bonus_poc')
+    fields.append('scoring_bonus_geo')
+
+  # gp screening, grant awards
+  if options['report_gps']:
+    fields.append('gps')
+  if options['report_gp_screening']:
+    fields.append('gp_screening')
+  if options['report_award']:
+    fields.append('awards')
+
+  return run_report(apps, [APP_COLUMNS[field] for field in fields])
+
+# -----------------------------------------------------------------------------
+#  Organization report
+# -----------------------------------------------------------------------------
+
+ORG_COLUMNS = org_columns()
+ORG_COLUMNS.update(registry(
+  Column('name'),
+  Column('email', path=lambda org: org.get_email(),
+         load=('user__username',), select=('user',))
+))
+
+def org_applications_column(linebreak):
+  """ Column listing an organization's applications, separated by linebreak """
+
+  def applications(org):
+    return ''.join(u'{} {:%m/%d/%Y}{}'.format(app.grant_cycle.title, app.submission_time, linebreak)
+                   for app in org.grantapplication_set.all())
+
+  return Column('applications', path=applications, header='Grant applications',
+                prefetch=('grantapplication_set__grant_cycle',))
+
+def org_awards_column(linebreak):
+  """ Column listing an organization's giving project and sponsored program grants,
+    separated by linebreak """
+
+  def awards(org):
+    awards_str = u''
+    for app in org.grantapplication_set.all():
+      for papp in app.projectapp_set.all():
+        try:
+          award = papp.givingprojectgrant
+        except models.GivingProjectGrant.DoesNotExist:
+          continue
+        timestamp = award.check_mailed or award.created
+        if timestamp:
+          timestamp = timestamp.strftime('%m/%d/%Y')
+        else:
+          timestamp = 'No timestamp'
+        awards_str += u'${} {} {}{}'.format(award.total_amount(),
+          papp.giving_project.title, timestamp, linebreak)
+
+    for award in org.sponsoredprogramgrant_set.all():
+      awards_str += '$%s %s %s' % (award.amount, ' sponsored program grant ',
+          (award.check_mailed or award.entered).strftime('%m/%d/%Y'))
+      awards_str += linebreak
+    return awards_str
+
+  return Column('awards', path=awards, header='Grants awarded', prefetch=(
+    'grantapplication_set__projectapp_set__giving_project',
+    'grantapplication_set__projectapp_set__givingprojectgrant',
+    'sponsoredprogramgrant_set'
+  ))
+
+def get_org_results(options):
+  """ Fetch organization report results
+
+  Args:
+    options: cleaned_data from a request.POST-filled instance of OrgReportForm
+
+  Returns:
+    A list of display-formatted field names. Example:
+      ['Name', 'Login', 'State']
+
+    ReportRows: organization & related info. Each item is a list of requested values
+    Example: (
+        ['Fancy pants org', 'fancy@pants.org', 'ID'],
+        ['Justice League', 'trouble@gender.org', 'WA']
+      )
+  """
+
+  # initial queryset
+  orgs = models.Organization.objects.order_by('name')
+
+  # filters
+  reg = options.get('registered')
+  if reg is True:
+    orgs = orgs.exclude(user__isnull=True)
+  elif reg is False:
+    org = orgs.filter(user__isnull=True)
+  if options.get('organization_name'):
+    orgs = orgs.filter(name__contains=options['organization_name'])
+  if options.get('city'):
+    orgs = orgs.filter(city=options['city'])
+  if options.get('state'):
+    orgs = orgs.filter(state__in=options['state'])
+  if options.get('has_fiscal_sponsor'):
+    orgs = orgs.exclude(fiscal_org='')
+
+  # fields
+  fields = ['name']
+  if options.get('report_account_email'):
+    fields.append('email')
+  fields += options['report_contact'] + options['report_org']
+  if options.get('report_fiscal'):
+    fields += models.GrantApplication.fields_starting_with('fiscal')
+    fields.remove('fiscal_letter')
+
+  columns = [ORG_COLUMNS[field] for field in fields]
+
+  # related objects
+  linebreak = '\n' if options['format'] == 'csv' else '<br>'
+  if options.get('report_applications'):
+    columns.append(org_applications_column(linebreak))
+  if options.get('report_awards'):
+    columns.append(org_awards_column(linebreak))
+
+  return run_report(orgs, columns)
+
+# -----------------------------------------------------------------------------
+#  Giving project grant report
+# -----------------------------------------------------------------------------
+
+GPG_COLUMNS = registry(
+  Column('id'),
+  Column('check_mailed'),
+  Column('check_number'),
+  Column('approved'),
+  Column('agreement_mailed'),
+  Column('agreement_returned'),
+  Column('first_year_amount', path='amount'),
+  Column('second_year_amount', path='second_amount', formatter=lambda val: val or ''),
+  Column('total_amount', path=lambda award: award.total_amount(),
+         load=('amount', 'second_amount')),
+  Column('organization', path='projectapp.application.organization.name'),
+  Column('giving_project', path='projectapp.giving_project.title'),
+  Column('grant_cycle', path='projectapp.application.grant_cycle.title'),
+  Column('support_type', path='projectapp.application.support_type'),
+  Column('year_end_report_due',
+         path=lambda award: award.next_yer_due(completed=award.yer_count),
+         load=('first_yer_due', 'second_amount'),
+         annotate={'yer_count': Count('yearendreport')})
+)
+GPG_ORG_COLUMNS = org_columns(path='projectapp.application.organization',
+                              header_prefix='Org. ')
+
+def get_gpg_results(options):
+  """ Fetch giving project grant report results
+
+  Args:
+    options: cleaned_data from a request.POST-filled instance of AwardReportForm
+
+  Returns:
+    field_names: A list of display-formatted field names.
+      Example: ['Amount', 'Check mailed', 'Organization']
+
+    rows: ReportRows of requested values for each award.
+      Example (matching field_names example): (
+          ['10000', '2013-10-23 09:08:56+0:00', 'Fancy pants org'],
+          ['5987', '2011-08-04 09:08:56+0:00', 'Justice League']
+        )
+  """
+
+  # initial queryset
+  gp_awards = models.GivingProjectGrant.objects.all()
+
+  # filters
+  min_year, max_year = get_min_max_year(options)
+  gp_awards = gp_awards.filter(created__gte=min_year, created__lte=max_year)
+
+  if options.get('organization_name'):
+    gp_awards = gp_awards.filter(
+        projectapp__application__organization__name__contains=options['organization_name'])
+
+  if options.get('city'):
+    gp_awards = gp_awards.filter(projectapp__application__city=options['city'])
+
+  if options.get('state'):
+    gp_awards = gp_awards.filter(projectapp__application__state__in=options['state'])
+
+  if options.get('has_fiscal_sponsor'):
+    gp_awards = gp_awards.exclude(projectapp__application__fiscal_org='')
+
+  if options.get('grant_cycle'):
+    gp_awards = gp_awards.filter(
+      projectapp__application__grant_cycle__title__in=options.get('grant_cycle')
+    )
+  if options.get('giving_projects'):
+    gp_awards = gp_awards.filter(
+      projectapp__giving_project__title__in=options.get('giving_projects')
+    )
+
+  # fields
+  fields = ['check_mailed', 'first_year_amount', 'second_year_amount', 'total_amount',
+            'organization', 'giving_project', 'grant_cycle']
+
+  if options.get('report_id'):
+    fields.append('id')
+  if options.get('report_check_number'):
+    fields.append('check_number')
+  if options.get('report_date_approved'):
+    fields.append('approved')
+  if options.get('report_agreement_dates'):
+    fields.append('agreement_mailed')
+    fields.append('agreement_returned')
+  if options.get('report_year_end_report_due'):
+    fields.append('year_end_report_due')
+  if options.get('report_support_type'):
+    fields.append('support_type')
+
+  org_fields = options['report_contact'] + options['report_org']
+  if options.get('report_fiscal'):
+    org_fields += models.GrantApplication.fields_starting_with('fiscal')
+    org_fields.remove('fiscal_letter')
+
+  columns = ([GPG_COLUMNS[field] for field in fields] +
+             [GPG_ORG_COLUMNS[field] for field in org_fields])
+  return run_report(gp_awards, columns)
+
+# -----------------------------------------------------------------------------
+#  Sponsored program grant report
+# -----------------------------------------------------------------------------
+
+SPONSORED_COLUMNS = registry(
+  Column('id'),
+  Column('check_mailed'),
+  Column('check_number'),
+  Column('approved'),
+  Column('amount'),
+  Column('organization', path='organization.name')
+)
+SPONSORED_ORG_COLUMNS = org_columns(path='organization', header_prefix='Org. ')
+
+def get_sponsored_award_results(options):
+  sponsored = models.SponsoredProgramGrant.objects.all()
+
+  min_year, max_year = get_min_max_year(options)
+  sponsored = sponsored.filter(entered__gte=min_year, entered__lte=max_year)
+
+  if options.get('organization_name'):
+    sponsored = sponsored.filter(organization__name__contains=options['organization_name'])
+  if options.get('city'):
+    sponsored = sponsored.filter(organization__city=options['city'])
+  if options.get('state'):
+    sponsored = sponsored.filter(organization__state__in=options['state'])
+  if options.get('has_fiscal_sponsor'):
+    sponsored = sponsored.exclude(organization__fiscal_org='')
+
+  # fields
+  fields = ['check_mailed', 'amount', 'organization']
+  if options.get('report_id'):
+    fields.append('id')
+  if options.get('report_check_number'):
+    fields.append('check_number')
+  if options.get('report_date_approved'):
+    fields.append('approved')
+
+  org_fields = options['report_contact'] + options['report_org']
+  if options.get('report_fiscal'):
+    org_fields += models.GrantApplication.fields_starting_with('fiscal')
+    org_fields.remove('fiscal_letter')
+
+  columns = ([SPONSORED_COLUMNS[field] for field in fields] +
+             [SPONSORED_ORG_COLUMNS[field] for field in org_fields])
+  return run_report(sponsored, columns)
@@ -85,6 +85,24 @@ class DraftWarning(BaseGrantTestCase):
     self.assert_length(mail.outbox, 0)
 
 
+  def test_query_count(self):
+    """ Drafts are fetched with their cycle, org and user in one query """
+    now = timezone.now()
+    long_cycle = factories.GrantCycle(close=now + timedelta(days=7, hours=12))
+    short_cycle = factories.GrantCycle(close=now + timedelta(days=2, hours=12))
+    later_cycle = factories.GrantCycle(close=now + timedelta(days=20))
+    for _ in range(3):
+      factories.DraftGrantApplication(grant_cycle=long_cycle, created=now - timedelta(days=12))
+      factories.DraftGrantApplication(grant_cycle=short_cycle, created=now)
+      # not due a warning
+      factories.DraftGrantApplication(grant_cycle=long_cycle, created=now)
+      factories.DraftGrantApplication(grant_cycle=later_cycle, created=now)
+
+    with self.assertNumQueries(1):
+      cron.draft_app_warning(None)
+    self.assert_length(mail.outbox, 6)
+
+
 class DiscardDraft(BaseGrantTestCase):
 
   url = reverse(views.discard_draft, kwargs={'draft_id': 1})
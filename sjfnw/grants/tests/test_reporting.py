@@ -1,14 +1,20 @@
 import logging
 from unittest import skip
 
+from mock import patch
+
 from django import forms
 from django.core.urlresolvers import reverse
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
 
 from sjfnw.grants.forms import (AppReportForm, SponsoredAwardReportForm,
     GPGrantReportForm, OrgReportForm)
+from sjfnw.grants.tests import factories
+from sjfnw.grants.reports import get_app_results, get_gpg_results, get_org_results
 from sjfnw.grants.tests.base import BaseGrantTestCase
-from sjfnw.grants import models
+from sjfnw.grants import constants as gc, models
 
 import unicodecsv
 
@@ -124,10 +130,34 @@ class AppReports(BaseGrantTestCase):
 
     response = self.client.post(self.url, post_dict)
 
+    self.assertTrue(response.streaming)
     reader = unicodecsv.reader(response, encoding='utf8')
     row_count = sum(1 for row in reader)
-    # 1st row is blank, 2nd is headers
-    self.assertEqual(row_count - 2, models.GrantApplication.objects.count())
+    # 1st row is headers
+    self.assertEqual(row_count - 1, models.GrantApplication.objects.count())
+
+  def test_app_browse_pages(self):
+    """ Browse format shows one page at a time, with link to next page """
+
+    for _ in range(3):
+      factories.GrantApplication()
+
+    form = AppReportForm()
+    post_dict = fill_report_form(form, select_fields=True)
+    post_dict['run-application'] = ''
+
+    with patch.object(gc, 'REPORT_PAGE_SIZE', 2):
+      response = self.client.post(self.url, post_dict)
+      self.assertTemplateUsed(response, self.template_success)
+      self.assert_length(response.context['results'], 2)
+      self.assertTrue(response.context['has_next'])
+      self.assertContains(response, 'Next page')
+
+      post_dict['page'] = 2
+      response = self.client.post(self.url, post_dict)
+      self.assert_length(response.context['results'], 1)
+      self.assertFalse(response.context['has_next'])
+      self.assertContains(response, 'Previous page')
 
   @skip("Needs additional fixtures")
   def test_app_filters_all(self):
@@ -146,6 +176,81 @@ class AppReports(BaseGrantTestCase):
     self.assertEqual(results, [])
 
 
+class ReportQueries(BaseGrantTestCase):
+  """ Number of queries a report runs should not depend on the number of rows """
+
+  def get_options(self, form_class):
+    data = fill_report_form(form_class(), select_fields=True)
+    if 'registered' in data:
+      data['registered'] = 'None' # as the browser would post it
+    form = form_class(data)
+    self.assertTrue(form.is_valid())
+    return form.cleaned_data
+
+  def get_query_count(self, results_func, options):
+    with CaptureQueriesContext(connection) as queries:
+      _, rows = results_func(options)
+      list(rows)
+    return len(queries)
+
+  def test_rows_sliced_in_sql(self):
+    """ Slicing rows limits the query instead of skipping fetched rows """
+    for _ in range(3):
+      factories.GrantApplication()
+    _, rows = get_app_results(self.get_options(AppReportForm))
+
+    with CaptureQueriesContext(connection) as queries:
+      page = list(rows[1:2])
+
+    self.assert_length(page, 1)
+    self.assertIn('LIMIT 1 OFFSET 1', queries[0]['sql'])
+
+  def test_app_gp_columns(self):
+    """ GPs, GP screening status and awards are included """
+
+    factories.GivingProjectGrant()
+
+    options = self.get_options(AppReportForm)
+    self.assertTrue(options['report_gps'] and options['report_gp_screening'] and
+                    options['report_award'])
+
+    expected = self.get_query_count(get_app_results, options)
+
+    for _ in range(4):
+      factories.GivingProjectGrant()
+    factories.ProjectApp()
+
+    self.assertEqual(self.get_query_count(get_app_results, options), expected)
+
+  def test_gpg_year_end_report_due(self):
+    award = factories.GivingProjectGrant()
+    factories.YearEndReport(award=award)
+
+    options = self.get_options(GPGrantReportForm)
+    self.assertTrue(options['report_year_end_report_due'])
+
+    expected = self.get_query_count(get_gpg_results, options)
+
+    for _ in range(4):
+      factories.GivingProjectGrant()
+
+    self.assertEqual(self.get_query_count(get_gpg_results, options), expected)
+
+  def test_org_applications_awards(self):
+    factories.GivingProjectGrant()
+
+    options = self.get_options(OrgReportForm)
+    self.assertTrue(options['report_applications'] and options['report_awards'])
+
+    expected = self.get_query_count(get_org_results, options)
+
+    for _ in range(4):
+      factories.GivingProjectGrant()
+    factories.GrantApplication()
+
+    self.assertEqual(self.get_query_count(get_org_results, options), expected)
+
+
 class OrgReports(BaseGrantTestCase):
 
   url = reverse('sjfnw.grants.views.grants_report')
@@ -202,7 +307,7 @@ class OrgReports(BaseGrantTestCase):
 
     reader = unicodecsv.reader(response, encoding='utf8')
     row_count = sum(1 for row in reader)
-    self.assertEqual(row_count - 2, models.Organization.objects.count())
+    self.assertEqual(row_count - 1, models.Organization.objects.count())
 
   def test_org_filters_all(self):
     """ Verify that all filters can be selected in org report without error
@@ -285,7 +390,7 @@ class GPGReports(BaseGrantTestCase):
 
     reader = unicodecsv.reader(response, encoding='utf8')
     row_count = sum(1 for row in reader)
-    self.assertEqual(row_count - 2, models.GivingProjectGrant.objects.count())
+    self.assertEqual(row_count - 1, models.GivingProjectGrant.objects.count())
 
   @skip("Needs additional fixtures")
   def test_gp_grant_filters_all(self):
@@ -369,7 +474,7 @@ class SponsoredAwardReports(BaseGrantTestCase):
 
     reader = unicodecsv.reader(response, encoding='utf8')
     row_count = sum(1 for row in reader)
-    self.assertEqual(row_count - 2, models.SponsoredProgramGrant.objects.count())
+    self.assertEqual(row_count - 1, models.SponsoredProgramGrant.objects.count())
 
   def test_sponsored_all_filters(self):
     """ Verify that all filters can be selected without error """
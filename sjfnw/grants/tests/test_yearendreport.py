@@ -7,6 +7,8 @@ from django.core.urlresolvers import reverse
 from django.test.utils import override_settings
 from django.utils import timezone
 
+from mock import patch
+
 from sjfnw.grants import cron, models, views
 from sjfnw.grants.tests import factories
 from sjfnw.grants.tests.base import BaseGrantTestCase
@@ -381,6 +383,46 @@ class YearEndReportReminders(BaseGrantTestCase):
     self.assertEqual(res.status_code, 200)
     self.assert_length(mail.outbox, 0)
 
+  def test_due_date_in_email(self):
+    due = timezone.now().date() + timedelta(days=30)
+    factories.GivingProjectGrant(first_yer_due=due)
+
+    self.client.get(self.url)
+
+    self.assert_length(mail.outbox, 1)
+    self.assertIn(str(due.year), mail.outbox[0].body)
+
+  def test_third_year(self):
+    """ Reminders follow next_yer_due for grants longer than two years """
+    today = timezone.now().date()
+    award = factories.GivingProjectGrant(
+      first_yer_due=(today + timedelta(days=7)).replace(year=today.year - 2),
+      second_amount=9000
+    )
+    factories.YearEndReport(award=award)
+    factories.YearEndReport(award=award)
+
+    with patch.object(models.GivingProjectGrant, 'grant_length', return_value=3):
+      res = self.client.get(self.url)
+
+    self.assertEqual(res.status_code, 200)
+    self.assert_length(mail.outbox, 1)
+
+  def test_query_count(self):
+    """ Awards are fetched with everything the email needs in one query """
+    today = timezone.now().date()
+    for _ in range(3):
+      factories.GivingProjectGrant(first_yer_due=today + timedelta(days=7))
+      award = factories.GivingProjectGrant(
+        first_yer_due=(today + timedelta(days=30)).replace(year=today.year - 1),
+        second_amount=9000
+      )
+      factories.YearEndReport(award=award)
+
+    with self.assertNumQueries(1):
+      cron.yer_reminder_email(None)
+    self.assert_length(mail.outbox, 6)
+
 
 class RolloverYER(BaseGrantTestCase):
   """ Test display and function of the rollover feature for YER """
@@ -13,6 +13,11 @@ from google.appengine.runtime import apiproxy_errors
 
 logger = logging.getLogger('sjfnw')
 
+# number of times a batch task will try to send a message before giving up
+MAX_BATCH_ATTEMPTS = 3
+# seconds to wait before retrying messages that failed
+BATCH_RETRY_DELAY = 60
+
 def _send_deferred(message, fail_silently=False):
   try:
     message.send()
@@ -20,12 +25,47 @@ def _send_deferred(message, fail_silently=False):
     if not fail_silently:
       raise
 
+def _send_deferred_batch(messages, fail_silently=False, attempt=1):
+  """ Send a list of messages in one task
+
+    A failed message doesn't affect the others. Failed messages are deferred
+    in a new task so that the ones that were sent aren't sent again.
+  """
+  failed = []
+  for message in messages:
+    try:
+      message.send()
+    except (gaemail.Error, apiproxy_errors.Error) as err:
+      logger.warning('Sending email to %s failed on attempt %d: %s', message.to, attempt, err)
+      failed.append(message)
+
+  if not failed:
+    return
+  if attempt < MAX_BATCH_ATTEMPTS:
+    _defer_batch(failed, fail_silently, attempt=attempt + 1, countdown=BATCH_RETRY_DELAY)
+  else:
+    logger.error('Giving up on %d email(s) after %d attempts: %s', len(failed), attempt,
+                 ', '.join(unicode(message.to) for message in failed))
+
+def _defer_batch(messages, fail_silently, attempt=1, countdown=0):
+  queue_name = getattr(settings, 'EMAIL_QUEUE_NAME', 'default')
+  deferred.defer(_send_deferred_batch, messages, fail_silently=fail_silently,
+                 attempt=attempt, _queue=queue_name, _countdown=countdown)
+
 
 class EmailBackend(BaseEmailBackend):
-  """ Asynchronous email backend """
+  """ Asynchronous email backend
+
+    If settings.EMAIL_BATCH_SIZE is set, messages passed to send_messages are
+    grouped into tasks of up to that many messages instead of one task each.
+  """
 
   def send_messages(self, email_messages):
-    """ Call _send for each message & return count of messages """
+    """ Queue messages to be sent & return count of messages queued """
+
+    batch_size = getattr(settings, 'EMAIL_BATCH_SIZE', None)
+    if batch_size:
+      return self._send_batched(email_messages, batch_size)
 
     num_sent = 0
     for message in email_messages:
@@ -33,6 +73,20 @@ class EmailBackend(BaseEmailBackend):
         num_sent += 1
     return num_sent
 
+  def _send_batched(self, email_messages, batch_size):
+    """ Convert messages and defer them in chunks of batch_size.
+      Messages that can't be converted are skipped (or raise, if not fail_silently) """
+
+    messages = []
+    for message in email_messages:
+      gmsg = self._convert(message)
+      if gmsg is not None:
+        messages.append(gmsg)
+
+    for start in range(0, len(messages), batch_size):
+      _defer_batch(messages[start:start + batch_size], self.fail_silently)
+    return len(messages)
+
   def _copy_message(self, message):
     """ Create and return App Engine EmailMessage class from message """
 
@@ -64,17 +118,23 @@ class EmailBackend(BaseEmailBackend):
           break
     return gmsg
 
-  def _send(self, message):
-    """
-    Use _copy_message to convert to gae email obj
-    Call _defer_message to add to send queue
-    """
+  def _convert(self, message):
+    """ Use _copy_message to convert to gae email obj. Returns None if invalid """
     try:
-      message = self._copy_message(message)
+      return self._copy_message(message)
     except (ValueError, gaemail.InvalidEmailError), err:
       logger.error(err)
       if not self.fail_silently:
         raise
+      return None
+
+  def _send(self, message):
+    """
+    Use _convert to convert to gae email obj
+    Call _defer_message to add to send queue
+    """
+    message = self._convert(message)
+    if message is None:
       return False
     self._defer_message(message)
     return True
@@ -23,6 +23,21 @@ INSTALLED_APPS = [
 DEBUG = False
 STAGING = False
 
+# memcache is only available on app engine & dev_appserver. elsewhere (tests,
+# manage.py commands) use a local cache
+if os.getenv('SERVER_SOFTWARE'):
+  CACHES = {
+    'default': {
+      'BACKEND': 'sjfnw.cache.MemcacheCache'
+    }
+  }
+else:
+  CACHES = {
+    'default': {
+      'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'
+    }
+  }
+
 # deployed
 if os.getenv('SERVER_SOFTWARE', '').startswith('Google App Engine'):
   DATABASES = {
@@ -99,6 +114,8 @@ LOGGING = {'version': 1}
 
 EMAIL_BACKEND = 'sjfnw.mail.EmailBackend'
 EMAIL_QUEUE_NAME = 'default'
+# max number of messages per task when sending multiple. See sjfnw/mail.py
+EMAIL_BATCH_SIZE = 50
 
 USE_TZ = True
 TIME_ZONE = 'America/Los_Angeles'
@@ -3,6 +3,7 @@ from unittest import TextTestRunner, TestResult
 from unittest.signals import registerResult
 
 from django.contrib.auth.models import User
+from django.core.cache import cache
 from django.test import TestCase
 from django.test.runner import DiscoverRunner
 
@@ -34,6 +35,11 @@ class BaseTestCase(TestCase):
     'blank': 'blankacct@gmail.com'
   }
 
+  def _pre_setup(self):
+    # db is reset between tests, so cached values would be stale
+    cache.clear()
+    super(BaseTestCase, self)._pre_setup()
+
   def login_strict(self, username, password):
     """ Attempt to login using the test client; mark test failed if login fails """
     success = self.client.login(username=username, password=password)
@@ -0,0 +1,57 @@
+from datetime import timedelta
+
+from django.core import mail
+from django.core.urlresolvers import reverse
+from django.utils import timezone
+
+from mock import Mock, patch
+
+from sjfnw import cron
+from sjfnw.fund import models
+from sjfnw.fund.tests.base import BaseFundTestCase
+
+
+class DailyEmails(BaseFundTestCase):
+
+  url = reverse(cron.daily_emails)
+
+  def setUp(self):
+    super(DailyEmails, self).setUp()
+    self.login_as_member('current')
+
+  def test_stats(self):
+    response = self.client.get(self.url)
+
+    self.assertEqual(response.status_code, 200)
+    lines = response.content.splitlines()
+    self.assertEqual([line.split(':')[0] for line in lines],
+                     [name for name, _ in cron.DAILY_STAGES])
+
+  def test_merged_per_recipient(self):
+    models.Step.objects.create(donor_id=self.donor_id, description='Overdue',
+                               date=timezone.now() - timedelta(days=3))
+    models.Donor.objects.filter(pk=self.donor_id).update(received_this=50)
+
+    response = self.client.get(self.url)
+
+    self.assertEqual(response.status_code, 200)
+    self.assertEqual(len(mail.outbox), 1)
+    email = mail.outbox[0]
+    self.assertEqual(email.to, [self.email])
+    self.assertEqual(email.subject, 'Fundraising Steps & Gift or pledge received')
+    self.assertIn('overdue fundraising step', email.body)
+    self.assertIn('gift or pledge received', email.body)
+
+    # records are marked as they would be by the separate jobs
+    self.assertIsNotNone(models.Membership.objects.get(pk=self.ship_id).emailed)
+    self.assertTrue(models.Donor.objects.get(pk=self.donor_id).gift_notified)
+    self.assertIn('gift_notify: 1 emails', response.content)
+
+  def test_stage_failed(self):
+    stages = [('fail', Mock(side_effect=ValueError('Oops')))] + cron.DAILY_STAGES
+    with patch.object(cron, 'DAILY_STAGES', stages):
+      response = self.client.get(self.url)
+
+    self.assertEqual(response.status_code, 500)
+    self.assertIn('fail: 0 emails', response.content)
+    self.assertIn('FAILED', response.content)
@@ -0,0 +1,86 @@
+from django.core.mail import EmailMultiAlternatives
+from django.test.utils import override_settings
+
+from google.appengine.api import mail as gaemail
+from mock import patch
+
+from sjfnw import mail
+from sjfnw.tests.base import BaseTestCase
+
+
+def make_messages(count):
+  return [EmailMultiAlternatives('Subject', 'Body', 'from@gmail.com',
+                                 ['to{}@gmail.com'.format(i)]) for i in range(count)]
+
+
+@patch('sjfnw.mail.deferred.defer')
+class BatchedSend(BaseTestCase):
+
+  @override_settings(EMAIL_BATCH_SIZE=2)
+  def test_chunks(self, defer):
+    num_sent = mail.EmailBackend().send_messages(make_messages(5))
+
+    self.assertEqual(num_sent, 5)
+    self.assertEqual(defer.call_count, 3)
+    batches = [call[0][1] for call in defer.call_args_list]
+    self.assertEqual([len(batch) for batch in batches], [2, 2, 1])
+    for call in defer.call_args_list:
+      self.assertIs(call[0][0], mail._send_deferred_batch)
+    self.assertEqual(batches[2][0].to, ['to4@gmail.com'])
+
+  @override_settings(EMAIL_BATCH_SIZE=None)
+  def test_not_batched(self, defer):
+    num_sent = mail.EmailBackend().send_messages(make_messages(3))
+
+    self.assertEqual(num_sent, 3)
+    self.assertEqual(defer.call_count, 3)
+    for call in defer.call_args_list:
+      self.assertIs(call[0][0], mail._send_deferred)
+
+  @override_settings(EMAIL_BATCH_SIZE=10)
+  def test_invalid_message(self, defer):
+    messages = make_messages(3)
+    messages[1].to = ['']
+
+    num_sent = mail.EmailBackend(fail_silently=True).send_messages(messages)
+
+    self.assertEqual(num_sent, 2)
+    self.assertEqual(defer.call_count, 1)
+    self.assertEqual(len(defer.call_args[0][1]), 2)
+
+
+@patch('sjfnw.mail.deferred.defer')
+class BatchTask(BaseTestCase):
+
+  def get_messages(self, count):
+    backend = mail.EmailBackend()
+    return [backend._copy_message(message) for message in make_messages(count)]
+
+  def test_all_sent(self, defer):
+    messages = self.get_messages(3)
+    with patch.object(gaemail.EmailMessage, 'send') as send:
+      mail._send_deferred_batch(messages)
+    self.assertEqual(send.call_count, 3)
+    self.assertFalse(defer.called)
+
+  def test_retry_failed(self, defer):
+    messages = self.get_messages(3)
+
+    def send(message):
+      if message.to == ['to1@gmail.com']:
+        raise gaemail.Error('Nope')
+
+    with patch.object(gaemail.EmailMessage, 'send', autospec=True, side_effect=send) as mock_send:
+      mail._send_deferred_batch(messages)
+
+    self.assertEqual(mock_send.call_count, 3)
+    self.assertEqual(defer.call_count, 1)
+    retry = defer.call_args
+    self.assertEqual(retry[0][1], [messages[1]])
+    self.assertEqual(retry[1]['attempt'], 2)
+
+  def test_give_up(self, defer):
+    messages = self.get_messages(2)
+    with patch.object(gaemail.EmailMessage, 'send', side_effect=gaemail.Error('Nope')):
+      mail._send_deferred_batch(messages, attempt=mail.MAX_BATCH_ATTEMPTS)
+    self.assertFalse(defer.called)
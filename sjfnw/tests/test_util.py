@@ -1,6 +1,9 @@
+from django.contrib.auth.models import User
+from django.core import mail
+from django.db import DEFAULT_DB_ALIAS, connections
 from django.test import TestCase
 
-from sjfnw import utils
+from sjfnw import constants as c, utils
 
 class CreateLink(TestCase):
 
@@ -14,3 +17,158 @@ class CreateLink(TestCase):
   def test_new_window(self):
     link = utils.create_link(self.url, self.text, new_tab=True)
     self.assertEqual(link, '<a href="{}" target="_blank">{}</a>'.format(self.url, self.text))
+
+
+class IterateInChunks(TestCase):
+
+  def test_multiple_chunks(self):
+    for i in range(5):
+      User.objects.create_user('user{}@gmail.com'.format(i))
+    users = User.objects.order_by('username')
+
+    result = list(utils.iterate_in_chunks(users, chunk_size=2))
+
+    self.assertEqual(result, list(users))
+
+
+class EmailBatch(TestCase):
+
+  template = 'fund/emails/gift_received.html'
+
+  def test_shared_and_own_context(self):
+    batch = utils.EmailBatch('Subject', 'from@gmail.com', self.template,
+                             shared_context={'login_url': 'http://login'})
+    batch.add(['a@gmail.com'], context={'gift_str': 'Gift A'})
+    batch.add(['b@gmail.com'], context={'gift_str': 'Gift B'}, subject='Other')
+
+    self.assertEqual(batch.send(), 2)
+    self.assertEqual(len(mail.outbox), 2)
+    first, second = mail.outbox
+    self.assertEqual(first.to, ['a@gmail.com'])
+    self.assertEqual(first.subject, 'Subject')
+    self.assertIn('Gift A', first.body)
+    self.assertIn('http://login', first.alternatives[0][0])
+    self.assertEqual(first.bcc, [c.SUPPORT_EMAIL])
+    self.assertEqual(second.subject, 'Other')
+    self.assertIn('Gift B', second.body)
+
+  def test_same_as_send_email(self):
+    context = {'login_url': 'http://login', 'gift_str': 'Gift'}
+    utils.send_email('Subject', ['a@gmail.com'], 'from@gmail.com', self.template, context)
+    batch = utils.EmailBatch('Subject', 'from@gmail.com', self.template)
+    batch.add(['a@gmail.com'], context=context)
+    batch.send()
+
+    single, batched = mail.outbox
+    self.assertEqual(single.body, batched.body)
+    self.assertEqual(single.alternatives, batched.alternatives)
+
+  def test_empty(self):
+    batch = utils.EmailBatch('Subject', 'from@gmail.com', self.template)
+    self.assertEqual(batch.send(), 0)
+    self.assertEqual(len(mail.outbox), 0)
+
+
+class MergeMessages(TestCase):
+
+  template = 'fund/emails/gift_received.html'
+
+  def test_same_recipient(self):
+    batch = utils.EmailBatch('Gifts', 'from@gmail.com', self.template)
+    batch.add(['a@gmail.com'], context={'gift_str': 'Gift A'})
+    batch.add(['b@gmail.com'], context={'gift_str': 'Gift B'})
+    batch.add(['a@gmail.com'], context={'gift_str': 'Gift C'}, subject='Steps')
+
+    merged = utils.merge_messages(batch.messages)
+
+    self.assertEqual(len(merged), 2)
+    first, second = merged
+    self.assertEqual(first.to, ['a@gmail.com'])
+    self.assertEqual(first.subject, 'Gifts & Steps')
+    self.assertIn('Gift A', first.body)
+    self.assertIn('Gift C', first.body)
+    self.assertEqual(len(first.alternatives), 1)
+    self.assertIn('Gift C', first.alternatives[0][0])
+    self.assertEqual(first.bcc, [c.SUPPORT_EMAIL])
+    self.assertIs(second, batch.messages[1])
+
+  def test_different_sender(self):
+    batch = utils.EmailBatch('Gifts', 'from@gmail.com', self.template)
+    batch.add(['a@gmail.com'], context={'gift_str': 'Gift A'})
+    other = utils.EmailBatch('Gifts', 'other@gmail.com', self.template)
+    other.add(['a@gmail.com'], context={'gift_str': 'Gift B'})
+
+    merged = utils.merge_messages(batch.messages + other.messages)
+
+    self.assertEqual(len(merged), 2)
+
+
+class RunStages(TestCase):
+
+  template = 'fund/emails/gift_received.html'
+
+  def stage(self, to, on_sent=None):
+    def run(_):
+      batch = utils.EmailBatch('Gifts', 'from@gmail.com', self.template)
+      batch.add([to], context={'gift_str': 'Gift'})
+      return batch.messages, on_sent
+    return run
+
+  def test_stats_and_callbacks(self):
+    sent = []
+    def on_sent():
+      sent.append(len(mail.outbox))
+      User.objects.count()
+
+    stats = utils.run_stages([('first', self.stage('a@gmail.com', on_sent)),
+                              ('second', self.stage('b@gmail.com'))], None)
+
+    self.assertEqual(len(mail.outbox), 2)
+    self.assertEqual(sent, [2]) # called after sending
+    self.assertEqual([stat['name'] for stat in stats], ['first', 'second'])
+    self.assertEqual(stats[0]['queries'], 1)
+    self.assertEqual(stats[1]['queries'], 0)
+    self.assertTrue(all(stat['emails'] == 1 and not stat['error'] for stat in stats))
+
+  def test_merge(self):
+    utils.run_stages([('first', self.stage('a@gmail.com')),
+                      ('second', self.stage('a@gmail.com'))], None, merge=True)
+    self.assertEqual(len(mail.outbox), 1)
+
+  def test_failed_stage(self):
+    def fail(_):
+      raise ValueError('Oops')
+
+    stats = utils.run_stages([('fail', fail), ('ok', self.stage('a@gmail.com'))], None)
+
+    self.assertTrue(stats[0]['error'])
+    self.assertFalse(stats[1]['error'])
+    self.assertEqual(len(mail.outbox), 1)
+
+
+class QueryCounter(TestCase):
+
+  def test_count(self):
+    with utils.QueryCounter() as counter:
+      User.objects.count()
+      list(User.objects.all())
+    User.objects.count()
+
+    self.assertEqual(counter.count, 2)
+
+  def test_nested(self):
+    with utils.QueryCounter() as outer:
+      User.objects.count()
+      with utils.QueryCounter() as inner:
+        User.objects.count()
+      User.objects.count()
+
+    self.assertEqual(inner.count, 1)
+    self.assertEqual(outer.count, 3)
+
+  def test_queries_not_logged(self):
+    connection = connections[DEFAULT_DB_ALIAS]
+    with utils.QueryCounter():
+      User.objects.count()
+      self.assertFalse(connection.queries_logged)
+    self.assertNotIn('make_cursor', connection.__dict__)
@@ -52,6 +52,7 @@ else:
     (r'^admin/grants/search/?', 'sjfnw.grants.views.grants_report'),
 
     # cron emails TODO use /cron instead of /mail?
+    (r'^mail/daily/?', 'sjfnw.cron.daily_emails'),
     (r'^mail/overdue-step', 'sjfnw.fund.cron.email_overdue'),
     (r'^mail/new-accounts', 'sjfnw.fund.cron.new_accounts'),
     (r'^mail/gifts', 'sjfnw.fund.cron.gift_notify'),
@@ -1,10 +1,21 @@
-from django.core.mail import EmailMultiAlternatives
+from collections import OrderedDict
+from itertools import chain
+import logging, time
+
+from django.core.mail import EmailMultiAlternatives, get_connection
 from django.core.urlresolvers import reverse
-from django.template.loader import render_to_string
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.backends.utils import CursorWrapper
+from django.http import StreamingHttpResponse
+from django.template.loader import get_template, render_to_string
 from django.utils.html import strip_tags
 
+import unicodecsv
+
 from sjfnw import constants as c
 
+logger = logging.getLogger('sjfnw')
+
 def create_link(url, text, new_tab=False):
   new_tab = ' target="_blank"' if new_tab else ''
   return '<a href="{}"{}>{}</a>'.format(url, new_tab, text)
@@ -19,3 +30,234 @@ def send_email(subject, to, sender, template, context={}):
   msg = EmailMultiAlternatives(subject, text_content, sender, to, [c.SUPPORT_EMAIL])
   msg.attach_alternative(html_content, 'text/html')
   msg.send()
+
+
+class EmailBatch(object):
+  """ Builds many emails from one template and sends them together
+
+    Like send_email, but the template is loaded and compiled once.
+
+    Args:
+      subject: default subject for messages
+      sender: from address
+      template: name of html template
+      shared_context: dict of context used for every message
+  """
+
+  def __init__(self, subject, sender, template, shared_context=None):
+    self.subject = subject
+    self.sender = sender
+    self.template = get_template(template)
+    self.shared_context = shared_context or {}
+    self.messages = []
+
+  def add(self, to, context=None, subject=None):
+    """ Render a message and add it to the batch
+
+      Args:
+        to: list of recipient addresses
+        context: dict of context specific to this message
+        subject: optional override of the batch's subject
+
+      Returns:
+        EmailMultiAlternatives
+    """
+    full_context = dict(self.shared_context)
+    full_context.update(context or {})
+    html_content = self.template.render(full_context)
+
+    msg = EmailMultiAlternatives(subject or self.subject, strip_tags(html_content), self.sender, to,
+                                 [c.SUPPORT_EMAIL])
+    msg.attach_alternative(html_content, 'text/html')
+    self.messages.append(msg)
+    return msg
+
+  def send(self):
+    """ Send all messages using one connection. Returns number sent """
+    if not self.messages:
+      return 0
+    return get_connection().send_messages(self.messages)
+
+
+def merge_messages(messages):
+  """ Combine messages that have the same sender and recipients into one
+
+    Subjects are joined and bodies (text and html) are appended in order,
+    so a recipient gets one email instead of several.
+
+    Args:
+      messages: list of EmailMultiAlternatives, as built by EmailBatch
+
+    Returns:
+      list of EmailMultiAlternatives
+  """
+  groups = OrderedDict()
+  for msg in messages:
+    key = (msg.from_email, tuple(msg.to), tuple(msg.cc), tuple(msg.bcc))
+    groups.setdefault(key, []).append(msg)
+
+  merged = []
+  for (from_email, to, cc, bcc), group in groups.iteritems():
+    if len(group) == 1:
+      merged.append(group[0])
+      continue
+    subjects = []
+    for msg in group:
+      if msg.subject not in subjects:
+        subjects.append(msg.subject)
+    text_content = '\n\n'.join(msg.body for msg in group)
+    msg = EmailMultiAlternatives(' & '.join(subjects), text_content, from_email, list(to),
+                                 list(bcc), cc=list(cc))
+    html_content = '<hr>'.join(content for message in group
+                               for content, mimetype in message.alternatives
+                               if mimetype == 'text/html')
+    msg.attach_alternative(html_content, 'text/html')
+    merged.append(msg)
+  return merged
+
+class _CountingCursor(CursorWrapper):
+
+  def __init__(self, cursor, db, counter):
+    super(_CountingCursor, self).__init__(cursor, db)
+    self.counter = counter
+
+  def execute(self, sql, params=None):
+    self.counter.count += 1
+    return super(_CountingCursor, self).execute(sql, params)
+
+  def executemany(self, sql, param_list):
+    self.counter.count += 1
+    return super(_CountingCursor, self).executemany(sql, param_list)
+
+
+class QueryCounter(object):
+  """ Context manager that counts queries run on a connection
+
+    Unlike django.test.utils.CaptureQueriesContext, it doesn't force the debug
+    cursor, so queries aren't stored or logged. Can be nested.
+  """
+
+  def __init__(self, using=DEFAULT_DB_ALIAS):
+    self.using = using
+    self.connection = None
+    self.count = 0
+    self._saved = {}
+
+  def _wrap(self, make_cursor):
+    def make_counting_cursor(cursor):
+      return _CountingCursor(make_cursor(cursor), self.connection, self)
+    return make_counting_cursor
+
+  def __enter__(self):
+    self.count = 0
+    self.connection = connections[self.using] # per thread
+    for name in ('make_cursor', 'make_debug_cursor'):
+      # instance attributes if an outer counter is active, else None
+      self._saved[name] = self.connection.__dict__.get(name)
+      setattr(self.connection, name, self._wrap(getattr(self.connection, name)))
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    for name, saved in self._saved.iteritems():
+      if saved is None:
+        delattr(self.connection, name)
+      else:
+        setattr(self.connection, name, saved)
+
+
+def run_stages(stages, snapshot, merge=False):
+  """ Run cron stages, then send all of their emails together
+
+    Each stage is timed and its queries counted so slow stages can be found in
+    the logs. A stage that raises is logged and skipped; the others still run.
+
+    Args:
+      stages: list of (name, function). Each function takes snapshot and returns
+        (messages, on_sent), where on_sent is None or a function to call after
+        the messages are sent (e.g. to mark records as emailed)
+      snapshot: data shared by the stages
+      merge: whether to combine emails to the same recipient (see merge_messages)
+
+    Returns:
+      list of dicts with name, seconds, queries, emails and error (boolean)
+  """
+  stats, messages, callbacks = [], [], []
+  for name, stage in stages:
+    stat = {'name': name, 'emails': 0, 'error': False}
+    start = time.time()
+    with QueryCounter() as queries:
+      try:
+        stage_messages, on_sent = stage(snapshot)
+      except Exception: # pylint: disable=broad-except
+        logger.exception('Cron stage %s failed', name)
+        stat['error'] = True
+      else:
+        stat['emails'] = len(stage_messages)
+        messages += stage_messages
+        if on_sent:
+          callbacks.append((stat, on_sent))
+    stat['seconds'] = time.time() - start
+    stat['queries'] = queries.count
+    stats.append(stat)
+
+  if merge:
+    messages = merge_messages(messages)
+  if messages:
+    get_connection().send_messages(messages)
+
+  # time spent marking records is counted toward the stage that needed it
+  for stat, on_sent in callbacks:
+    start = time.time()
+    with QueryCounter() as queries:
+      on_sent()
+    stat['seconds'] += time.time() - start
+    stat['queries'] += queries.count
+
+  for stat in stats:
+    logger.info('Cron stage %(name)s: %(emails)d emails, %(queries)d queries, '
+                '%(seconds).2fs%(failed)s', dict(stat, failed=' FAILED' if stat['error'] else ''))
+  return stats
+
+
+def stages_status(stats):
+  """ HTTP status for a cron request, from run_stages stats: 500 if any stage failed """
+  return 500 if any(stat['error'] for stat in stats) else 200
+
+
+class _Echo(object):
+  """ File-like object for csv writers. Returns lines instead of storing them """
+
+  def write(self, value):
+    return value
+
+def csv_response(filename, header, rows):
+  """ Stream a csv attachment line by line instead of building it in memory
+
+    Args:
+      filename: name of downloaded file, without extension
+      header: list of column names
+      rows: iterable of lists of values. Can be a generator
+
+    Returns:
+      StreamingHttpResponse
+  """
+  writer = unicodecsv.writer(_Echo())
+  lines = chain([writer.writerow(header)], (writer.writerow(row) for row in rows))
+  response = StreamingHttpResponse(lines, content_type='text/csv')
+  response['Content-Disposition'] = 'attachment; filename={}.csv'.format(filename)
+  return response
+
+def iterate_in_chunks(queryset, chunk_size=500):
+  """ Iterate over a queryset one slice at a time
+
+    For querysets that use prefetch_related, which .iterator() ignores.
+    Queryset must have a stable ordering.
+  """
+  offset = 0
+  while True:
+    chunk = list(queryset[offset:offset + chunk_size])
+    for obj in chunk:
+      yield obj
+    if len(chunk) < chunk_size:
+      return
+    offset += chunk_size